@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
 from cassidy.selectors.selectors import ElementSelector, AttributeSelector
-from css3syntax.tokenizer import Tokenizer
-from css3syntax.parser import Parser, Primitive, SimpleBlock
+from css3syntax.tokenizer import DelimToken, IdentToken, OpenSquareToken, StringToken, Tokenizer, WhitespaceToken
+from css3syntax.parser import Parser, SimpleBlock
 
 # assert parser.parse("e") == ElementSelector("e")
 
@@ -17,7 +17,7 @@ FOLLOWED_BY_MODE = 4
 class Selector:
 
     def __init__(self, s):
-        p = Parser(list(Tokenizer(s + "{}").tokenize()))
+        p = Parser(Tokenizer().tokenize(s + "{}"))
         p.parse()
         self.primitives = p.open_rule_stack[0].value[0].selector
         self.index = 0
@@ -27,7 +27,7 @@ class Selector:
     def consume_next_primitive(self):
         primitive = self.primitives[self.index]
         self.index += 1
-        if isinstance(primitive, Primitive) and primitive.primitive[0] == "whitespace":
+        if isinstance(primitive, WhitespaceToken):
             return self.consume_next_primitive()
         return primitive
 
@@ -47,7 +47,7 @@ class Selector:
             elif self.mode == FOLLOWED_BY_MODE:
                 self.followed_by_mode()
             else:
-                print "UNKNOWN MODE", self.mode
+                print("UNKNOWN MODE", self.mode)
                 quit()
 
         return self.current_selector
@@ -55,17 +55,14 @@ class Selector:
     def top_level_mode(self):
         primitive = self.consume_next_primitive()
 
-        if isinstance(primitive, Primitive):
-            if primitive.primitive[0] == "identifier":
-                self.current_selector = ElementSelector(primitive.primitive[1])
-                self.mode = ELEMENT_MODE
-            elif primitive.primitive == ("delim", "*"):
-                self.current_selector = ElementSelector()
-                self.mode = ELEMENT_MODE
-            else:
-                assert False
+        if isinstance(primitive, IdentToken):
+            self.current_selector = ElementSelector(primitive.value)
+            self.mode = ELEMENT_MODE
+        elif primitive == DelimToken("*"):
+            self.current_selector = ElementSelector()
+            self.mode = ELEMENT_MODE
         elif isinstance(primitive, SimpleBlock):
-            if primitive.associated_token == ("[",):
+            if isinstance(primitive.associated_token, OpenSquareToken):
                 self.reprocess_current_primitive()
                 self.mode = ATTRIBUTE_MODE
             else:
@@ -77,76 +74,73 @@ class Selector:
         primitive = self.consume_next_primitive()
 
         if isinstance(primitive, SimpleBlock):
-            if primitive.associated_token == ("[",):
+            if isinstance(primitive.associated_token, OpenSquareToken):
                 self.reprocess_current_primitive()
                 self.mode = ATTRIBUTE_MODE
             else:
                 assert False
-        elif isinstance(primitive, Primitive):
-            if primitive.primitive[0] == "identifier":
-                self.current_selector = self.current_selector.descendant(ElementSelector(primitive.primitive[1]))
-            elif primitive.primitive == ("delim", ">"):
-                self.mode = CHILD_MODE
-            elif primitive.primitive == ("delim", "*"):
-                self.current_selector = self.current_selector.descendant(ElementSelector())
-            elif primitive.primitive == ("delim", "+"):
-                self.mode = FOLLOWED_BY_MODE
-            else:
-                assert False
+        elif isinstance(primitive, IdentToken):
+            self.current_selector = self.current_selector.descendant(ElementSelector(primitive.value))
+        elif primitive == DelimToken(">"):
+            self.mode = CHILD_MODE
+        elif primitive == DelimToken("*"):
+            self.current_selector = self.current_selector.descendant(ElementSelector())
+        elif primitive == DelimToken("+"):
+            self.mode = FOLLOWED_BY_MODE
         else:
             assert False
 
     def child_mode(self):
         primitive = self.consume_next_primitive()
 
-        if isinstance(primitive, Primitive) and primitive.primitive[0] == "identifier":
-            self.current_selector = self.current_selector.child(ElementSelector(primitive.primitive[1]))
+        if isinstance(primitive, IdentToken):
+            self.current_selector = self.current_selector.child(ElementSelector(primitive.value))
         else:
             assert False
 
     def followed_by_mode(self):
         primitive = self.consume_next_primitive()
 
-        if isinstance(primitive, Primitive) and primitive.primitive[0] == "identifier":
-            self.current_selector = self.current_selector.followed_by(ElementSelector(primitive.primitive[1]))
+        if isinstance(primitive, IdentToken):
+            self.current_selector = self.current_selector.followed_by(ElementSelector(primitive.value))
         else:
             assert False
 
     def attribute_mode(self):
         block = self.consume_next_primitive()
         if len(block.value) == 1:
-            if block.value[0].primitive[0] == "identifier":
+            if isinstance(block.value[0], IdentToken):
                 if self.current_selector:
-                    attr_selector = AttributeSelector(block.value[0].primitive[1])
+                    attr_selector = AttributeSelector(block.value[0].value)
                     self.current_selector.append(attr_selector)
                 else:
-                    self.current_selector = AttributeSelector(block.value[0].primitive[1])
+                    self.current_selector = AttributeSelector(block.value[0].value)
             else:
                 assert False
         elif len(block.value) == 3:
             if (
-                block.value[0].primitive[0] == "identifier" and
-                block.value[1].primitive[0] == "delim" and
-                block.value[2].primitive[0] == "string"
+                isinstance(block.value[0], IdentToken) and
+                isinstance(block.value[1], DelimToken) and
+                isinstance(block.value[2], StringToken)
             ):
                 attr_selector = AttributeSelector(
-                    block.value[0].primitive[1],
-                    block.value[2].primitive[1],
-                    block.value[1].primitive[1])
+                    block.value[0].value,
+                    block.value[2].value,
+                    block.value[1].value)
                 self.current_selector.append(attr_selector)
             else:
                 assert False
         elif len(block.value) == 4:
             if (
-                block.value[0].primitive[0] == "identifier" and
-                block.value[1].primitive[0] == "delim" and
-                block.value[2].primitive[0] == "delim" and
-                block.value[3].primitive[0] == "string"
+                isinstance(block.value[0], IdentToken) and
+                isinstance(block.value[1], DelimToken) and
+                isinstance(block.value[2], DelimToken) and
+                isinstance(block.value[3], StringToken)
             ):
                 attr_selector = AttributeSelector(
-                    block.value[0].primitive[1],
-                    block.value[3].primitive[1],
-                    block.value[1].primitive[1] + block.value[2].primitive[1])
+                    block.value[0].value,
+                    block.value[3].value,
+                    block.value[1].value + block.value[2].value)
                 self.current_selector.append(attr_selector)
             else:
                 assert False
@@ -0,0 +1,19 @@
+import mmap
+import os
+
+from .preprocessing import PreprocessingReader
+from .tokenizer import Tokenizer
+
+
+# tokenizes a stylesheet on disk through a memory map, so only a window of it
+# is ever decoded into a str
+def tokenize_file(
+    path, unicode_ranges_allowed=False, fast=True, compact=False, intern_names=False, chunk_size=65536
+):
+    tokenizer = Tokenizer(unicode_ranges_allowed, fast=fast, compact=compact, intern_names=intern_names)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield from tokenizer.tokenize("")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from tokenizer.tokenize_stream(PreprocessingReader(mapped), chunk_size)
@@ -0,0 +1,63 @@
+from sys import intern
+from typing import Iterable
+
+from .parser import Declaration, Parser
+from .tokenizer import TOKEN_TYPES, EofToken, SingletonToken, SpanToken, Token, Tokenizer, token_key
+
+SPAN_TOKEN_TYPES = frozenset(token_type for token_type in TOKEN_TYPES if issubclass(token_type, SpanToken))
+
+
+# tokenizes many short inputs (style attributes, selectors) with one
+# tokenizer; identical inputs get the same token list and equal tokens are
+# the same object, so the results are shared and mustn't be changed in place,
+# and tokens have no position (it's -1)
+def tokenize_batch(
+    inputs: Iterable[str], unicode_ranges_allowed: bool = False
+) -> list[list[Token]]:
+    tokenizer = Tokenizer(unicode_ranges_allowed, fast=True)
+    consume_a_token = tokenizer.consume_a_token_fast
+    token_lists = {}
+    interned = {}
+    batch = []
+
+    for s in inputs:
+        tokens = token_lists.get(s)
+        if tokens is None:
+            tokens = []
+            tokenizer.s = s
+            tokenizer.index = 0
+            while True:
+                token = consume_a_token(unicode_ranges_allowed)
+                token_type = type(token)
+                if not isinstance(token, SingletonToken):
+                    key = token_key(token)
+                    shared = interned.get(key)
+                    if shared is None:
+                        if token_type in SPAN_TOKEN_TYPES:
+                            # a new token, so no span into this input is kept
+                            token = token_type(intern(token.value))
+                        shared = interned[key] = token
+                    token = shared
+                tokens.append(token)
+                if token_type is EofToken:
+                    break
+            token_lists[s] = tokens
+        batch.append(tokens)
+
+    return batch
+
+
+# parses each input as a declaration list, as for a style attribute
+def parse_declaration_lists(
+    inputs: Iterable[str], unicode_ranges_allowed: bool = False
+) -> list[tuple[Declaration, ...]]:
+    declaration_lists = {}
+    batch = []
+    for tokens in tokenize_batch(inputs, unicode_ranges_allowed):
+        # identical inputs share a token list
+        declarations = declaration_lists.get(id(tokens))
+        if declarations is None:
+            declarations = Parser(tokens).parse_declaration_list()
+            declaration_lists[id(tokens)] = declarations
+        batch.append(declarations)
+    return batch
@@ -0,0 +1,301 @@
+import marshal
+import os
+import tempfile
+from collections import OrderedDict
+from hashlib import blake2b
+from sys import getsizeof
+from typing import Generator, Iterable
+
+from .parser import PARSER_VERSION, AtRule, Declaration, Function, Parser, SimpleBlock, StyleRule, Stylesheet
+from .tokenizer import TOKEN_TYPE_CODES, TOKEN_TYPES, SingletonToken, SpanToken, Token, Tokenizer
+
+# objects every entry refers to, which aren't counted against any of them
+SHARED = frozenset(
+    [id(None)]
+    + [id(token_type()) for token_type in TOKEN_TYPES if issubclass(token_type, SingletonToken)]
+)
+
+
+def content_hash(s: str) -> bytes:
+    return blake2b(s.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+# the attributes an object of a slotted class can refer to anything through
+def slot_names(cls: type) -> tuple[str, ...]:
+    return tuple(
+        name for base in cls.__mro__ for name in base.__dict__.get("__slots__", ())
+    )
+
+
+# roughly how many bytes an entry takes up, counting everything it refers to
+# once; shared tokens cost nothing
+def estimate_size(value) -> int:
+    size = 0
+    seen = set(SHARED)
+    names_by_type = {}
+    stack = [value]
+    pop = stack.pop
+    push = stack.extend
+    while stack:
+        obj = pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += getsizeof(obj)
+        cls = type(obj)
+        if cls is list or cls is tuple:
+            push(obj)
+        elif cls is str or cls is int or cls is float:
+            pass
+        elif hasattr(obj, "__dict__"):
+            push(obj.__dict__.values())
+        else:
+            names = names_by_type.get(cls)
+            if names is None:
+                names = names_by_type[cls] = slot_names(cls)
+            push([getattr(obj, name, None) for name in names])
+    return size
+
+
+# decodes span token values as they go by, so nothing cached keeps the input
+# alive
+def materialize(tokens: Iterable[Token]) -> Generator[Token]:
+    for token in tokens:
+        if isinstance(token, SpanToken):
+            token.value
+        yield token
+
+
+# an opt-in LRU cache of token sequences and parsed stylesheets, keyed by a
+# hash of the input so the input itself isn't kept alive; what it returns is
+# shared between callers and mustn't be changed in place
+class ParseCache:
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        unicode_ranges_allowed: bool = False,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.unicode_ranges_allowed = unicode_ranges_allowed
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def tokenize(self, s: str) -> tuple[Token, ...]:
+        key = ("tokens", content_hash(s))
+        entry = self.lookup(key)
+        if entry is not None:
+            return entry
+        tokens = tuple(materialize(Tokenizer(self.unicode_ranges_allowed, fast=True).tokenize(s)))
+        self.store(key, tokens)
+        return tokens
+
+    def parse(self, s: str) -> Stylesheet:
+        key = ("stylesheet", content_hash(s))
+        entry = self.lookup(key)
+        if entry is not None:
+            return entry
+        stylesheet = Parser(
+            materialize(Tokenizer(self.unicode_ranges_allowed, fast=True).tokenize(s))
+        ).parse()
+        self.store(key, stylesheet)
+        return stylesheet
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def store(self, key, value) -> None:
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.size += size
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# node tags for encode_item, numbered on from the token type codes
+STYLESHEET, AT_RULE, STYLE_RULE, DECLARATION, FUNCTION, SIMPLE_BLOCK = range(
+    len(TOKEN_TYPES), len(TOKEN_TYPES) + 6
+)
+
+# what a token's tuple holds after its type code
+TOKEN_FIELDS = {
+    token_type: ("value",) if issubclass(token_type, SpanToken) else token_type.__match_args__
+    for token_type in TOKEN_TYPES
+    if not issubclass(token_type, SingletonToken)
+}
+
+SINGLETONS = [
+    token_type() if issubclass(token_type, SingletonToken) else None for token_type in TOKEN_TYPES
+]
+
+# written ahead of each saved tree; marshal's format can change between
+# Python versions, so its version is part of it
+DISK_MAGIC = b"css3syntax-tree" + bytes([marshal.version])
+
+
+# a tree as nested tuples of ints, strings and numbers, which marshal can
+# write: a token without a value is just its type code, and anything else is
+# a tuple that starts with a type code or node tag. equal tokens are encoded
+# as the same tuple, which marshal then writes once, so token positions
+# aren't kept
+def encode_item(item, tokens: dict):
+    cls = type(item)
+    fields = TOKEN_FIELDS.get(cls)
+    if fields is not None:
+        encoded = (TOKEN_TYPE_CODES[cls], *[getattr(item, field) for field in fields])
+        # repr tells 1 from 1.0 and 0.0 from -0.0, which == doesn't
+        return tokens.setdefault(repr(encoded), encoded)
+    elif isinstance(item, SingletonToken):
+        return TOKEN_TYPE_CODES[cls]
+    elif cls is Declaration:
+        return (DECLARATION, item.name, item.important, encode_items(item.value, tokens))
+    elif cls is StyleRule:
+        return (STYLE_RULE, encode_items(item.selector, tokens), encode_items(item.value, tokens))
+    elif cls is Function:
+        return (FUNCTION, item.name, tuple([encode_items(argument, tokens) for argument in item.arguments]))
+    elif cls is SimpleBlock:
+        return (SIMPLE_BLOCK, encode_item(item.associated_token, tokens), encode_items(item.value, tokens))
+    elif cls is AtRule:
+        return (AT_RULE, item.name, encode_items(item.prelude, tokens), encode_items(item.value, tokens))
+    else:
+        return (STYLESHEET, encode_items(item.value, tokens))
+
+
+def encode_items(items, tokens: dict) -> tuple:
+    return tuple([encode_item(item, tokens) for item in items])
+
+
+# a tuple written once comes back as one object, and so becomes one token
+# that every place it was used shares; tokens are keyed by the tuple's id
+def decode_item(item, tokens: dict):
+    if type(item) is int:
+        return SINGLETONS[item]
+    tag = item[0]
+    if tag < STYLESHEET:
+        token = tokens.get(id(item))
+        if token is None:
+            token = tokens[id(item)] = TOKEN_TYPES[tag](*item[1:])
+        return token
+    elif tag == DECLARATION:
+        node = Declaration(item[1])
+        node.important = item[2]
+        node.value = decode_items(item[3], tokens)
+    elif tag == STYLE_RULE:
+        node = StyleRule()
+        node.selector = decode_items(item[1], tokens)
+        node.value = decode_items(item[2], tokens)
+    elif tag == FUNCTION:
+        node = Function(item[1])
+        node.arguments = tuple([decode_items(argument, tokens) for argument in item[2]])
+    elif tag == SIMPLE_BLOCK:
+        node = SimpleBlock(decode_item(item[1], tokens))
+        node.value = decode_items(item[2], tokens)
+    elif tag == AT_RULE:
+        node = AtRule(item[1])
+        node.prelude = decode_items(item[2], tokens)
+        node.value = decode_items(item[3], tokens)
+    elif tag == STYLESHEET:
+        node = Stylesheet()
+        node.value = decode_items(item[1], tokens)
+    else:
+        raise ValueError(f"unknown node tag {tag}")
+    return node
+
+
+def decode_items(items, tokens: dict) -> tuple:
+    return tuple([decode_item(item, tokens) for item in items])
+
+
+# parsed stylesheets saved as files in a directory, so they outlive the
+# process; a file is only loaded if this PARSER_VERSION wrote it for the same
+# content, anything else is parsed again and the file replaced
+class DiskCache:
+    def __init__(self, directory: str, unicode_ranges_allowed: bool = False):
+        self.directory = directory
+        self.unicode_ranges_allowed = unicode_ranges_allowed
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: bytes) -> str:
+        suffix = "-u.tree" if self.unicode_ranges_allowed else ".tree"
+        return os.path.join(self.directory, digest.hex() + suffix)
+
+    def parse(self, s: str) -> Stylesheet:
+        digest = content_hash(s)
+        path = self.path(digest)
+        stylesheet = self.load(path, digest)
+        if stylesheet is not None:
+            self.hits += 1
+            return stylesheet
+        self.misses += 1
+        stylesheet = Parser(Tokenizer(self.unicode_ranges_allowed, fast=True).tokenize(s)).parse()
+        self.save(path, digest, stylesheet)
+        return stylesheet
+
+    def load(self, path: str, digest: bytes) -> Stylesheet | None:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data.startswith(DISK_MAGIC):
+            return None
+        try:
+            version, saved_digest, tree = marshal.loads(memoryview(data)[len(DISK_MAGIC):])
+            if version != PARSER_VERSION or saved_digest != digest or tree[0] != STYLESHEET:
+                return None
+            return decode_item(tree, {})
+        except Exception:
+            # a damaged or foreign file is just a miss
+            return None
+
+    # written to a temporary file first so a reader never sees half a tree;
+    # a directory that can't be written to only costs the next start its
+    # head start
+    def save(self, path: str, digest: bytes, stylesheet: Stylesheet) -> None:
+        data = DISK_MAGIC + marshal.dumps((PARSER_VERSION, digest, encode_item(stylesheet, {})))
+        try:
+            fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temporary, path)
+            except BaseException:
+                os.remove(temporary)
+                raise
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,44 @@
+from collections import deque
+
+from .cache import content_hash
+from .parallel import parse_chunk, top_level_block_ends
+from .parser import Stylesheet
+
+
+# parses s, reusing the rules of previous wherever s has a chunk with the
+# same text as one previous was parsed from; a chunk runs up to a "}" that
+# closes a top-level block (or to the end), so an edit only reparses the
+# rules in the chunks it touches. previous is a stylesheet this returned
+# (or None) for the same unicode_ranges_allowed, and reused rules are the
+# very same objects, with the token offsets of the source they came from
+def reparse(
+    previous: Stylesheet | None, s: str, unicode_ranges_allowed: bool = False
+) -> Stylesheet:
+    reusable = {}
+    if previous is not None and previous.chunks is not None:
+        index = 0
+        for digest, count in previous.chunks:
+            reusable.setdefault(digest, deque()).append(previous.value[index : index + count])
+            index += count
+
+    rules = []
+    chunks = []
+    bounds = [0, *top_level_block_ends(s)]
+    if bounds[-1] != len(s):
+        bounds.append(len(s))
+    for start, end in zip(bounds, bounds[1:]):
+        chunk = s[start:end]
+        digest = content_hash(chunk)
+        # the same text twice gets parsed twice rather than sharing rules
+        reused = reusable.get(digest)
+        if reused:
+            chunk_rules = reused.popleft()
+        else:
+            chunk_rules = parse_chunk((chunk, start, unicode_ranges_allowed))
+        rules.extend(chunk_rules)
+        chunks.append((digest, len(chunk_rules)))
+
+    stylesheet = Stylesheet()
+    stylesheet.value = tuple(rules)
+    stylesheet.chunks = tuple(chunks)
+    return stylesheet
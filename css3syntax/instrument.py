@@ -0,0 +1,117 @@
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, process_time
+from typing import Generator, Iterable
+
+# what a Parser made inside instrumented() reports to; with nothing active a
+# parser runs exactly as it would without this module
+ACTIVE = None
+
+
+# counts and times what the parsers given it do; peak allocations are only
+# measured with memory set and tracemalloc tracing, which instrumented()
+# sees to
+class Instrumentation:
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.token_counts = Counter()
+        self.tokenize_seconds = 0.0
+        self.mode_calls = Counter()
+        self.mode_seconds = defaultdict(float)
+        self.phases = {}
+        self.open_phases = []  # [traced memory at start, peak so far]
+
+    # counts tokens by type as they are pulled, and the time spent pulling
+    # them, which with Tokenizer.tokenize() is the time spent tokenizing
+    def count_tokens(self, tokens: Iterable) -> Generator:
+        counts = self.token_counts
+        iterator = iter(tokens)
+        while True:
+            start = perf_counter()
+            token = next(iterator, None)
+            self.tokenize_seconds += perf_counter() - start
+            if token is None:
+                return
+            counts[type(token).__name__] += 1
+            yield token
+
+    # runs one step of a parser mode; time spent pulling tokens during it is
+    # left to tokenize_seconds
+    def run_mode(self, name: str, method) -> None:
+        tokenize_seconds = self.tokenize_seconds
+        start = perf_counter()
+        method()
+        self.mode_seconds[name] += perf_counter() - start - (self.tokenize_seconds - tokenize_seconds)
+        self.mode_calls[name] += 1
+
+    # wall and CPU time of everything in the block, summed over every time a
+    # phase of that name runs; phases can nest
+    @contextmanager
+    def phase(self, name: str):
+        frame = [0, 0]
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.open_phases:
+                self.open_phases[-1][1] = max(self.open_phases[-1][1], peak)
+            tracemalloc.reset_peak()
+            frame = [current, current]
+        self.open_phases.append(frame)
+        wall = perf_counter()
+        cpu = process_time()
+        try:
+            yield
+        finally:
+            wall = perf_counter() - wall
+            cpu = process_time() - cpu
+            self.open_phases.pop()
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+                if self.memory:
+                    entry["peak_bytes"] = 0
+            entry["count"] += 1
+            entry["wall_seconds"] += wall
+            entry["cpu_seconds"] += cpu
+            if self.memory:
+                peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+                entry["peak_bytes"] = max(entry["peak_bytes"], peak - frame[0])
+                if self.open_phases:
+                    self.open_phases[-1][1] = max(self.open_phases[-1][1], peak)
+
+    def as_dict(self) -> dict:
+        return {
+            "tokens": dict(self.token_counts),
+            "tokenize_seconds": self.tokenize_seconds,
+            "modes": {
+                name: {"calls": calls, "seconds": self.mode_seconds[name]}
+                for name, calls in self.mode_calls.items()
+            },
+            "phases": {name: dict(entry) for name, entry in self.phases.items()},
+        }
+
+
+# makes every Parser created in the block report to a new Instrumentation
+@contextmanager
+def instrumented(memory: bool = False):
+    global ACTIVE
+    instrumentation = Instrumentation(memory)
+    previous = ACTIVE
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    ACTIVE = instrumentation
+    try:
+        yield instrumentation
+    finally:
+        ACTIVE = previous
+        if started:
+            tracemalloc.stop()
+
+
+# a phase of the active instrumentation, or nothing when there is none, for
+# timing steps around parsing such as building selectors
+def phase(name: str):
+    if ACTIVE is None:
+        return nullcontext()
+    return ACTIVE.phase(name)
@@ -0,0 +1,192 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+from .parser import AtRule, SimpleBlock, Stylesheet
+from .tokenizer import (
+    ColonToken,
+    CommaToken,
+    DimensionToken,
+    IdentToken,
+    NumberToken,
+    OpenParen,
+    WhitespaceToken,
+)
+
+# media features are compared in px and dppx; em and rem are relative to the
+# initial font size
+LENGTH_UNITS = {
+    "px": 1,
+    "em": 16,
+    "rem": 16,
+    "in": 96,
+    "cm": 96 / 2.54,
+    "mm": 96 / 25.4,
+    "q": 96 / 101.6,
+    "pt": 96 / 72,
+    "pc": 16,
+}
+RESOLUTION_UNITS = {"dppx": 1, "x": 1, "dpi": 1 / 96, "dpcm": 2.54 / 96}
+
+FEATURE_UNITS = {"width": LENGTH_UNITS, "resolution": RESOLUTION_UNITS}
+
+# a query that is never true, which is what a malformed one (or one testing
+# a feature not known here) becomes
+NOT_ALL = (True, "all", frozenset())
+
+ALL = frozenset([(False, "all", frozenset())])
+
+
+# what a media query is evaluated against
+@dataclass(frozen=True, slots=True)
+class Environment:
+    width: float
+    media_type: str = "screen"
+    resolution: float = 1.0  # in dppx
+
+
+def significant(items) -> list:
+    return [item for item in items if not isinstance(item, WhitespaceToken)]
+
+
+# a media feature expression as (name, value), with the value in px or dppx,
+# or None when the feature is tested on its own
+def parse_media_feature(block):
+    if not (isinstance(block, SimpleBlock) and isinstance(block.associated_token, OpenParen)):
+        return None
+    items = significant(block.value)
+    if not items or not isinstance(items[0], IdentToken):
+        return None
+    name = items[0].value.lower()
+    prefixed = name.startswith(("min-", "max-"))
+    units = FEATURE_UNITS.get(name[4:] if prefixed else name)
+    if units is None:
+        return None
+    if len(items) == 1:
+        # only a feature without min- or max- can be tested on its own
+        return None if prefixed else (name, None)
+    if len(items) != 3 or not isinstance(items[1], ColonToken):
+        return None
+    value = items[2]
+    if isinstance(value, DimensionToken) and value.unit.lower() in units:
+        return (name, value.value * units[value.unit.lower()])
+    elif isinstance(value, NumberToken) and value.value == 0 and units is LENGTH_UNITS:
+        return (name, 0)
+    return None
+
+
+# Media Queries 3: [only | not]? type [and (feature)]* | (feature) [and
+# (feature)]*, as (negated, media type, frozenset of features)
+def parse_media_query(items):
+    items = significant(items)
+    negated = False
+    media_type = "all"
+    i = 0
+    if i < len(items) and isinstance(items[i], IdentToken) and items[i].value.lower() in ("not", "only"):
+        negated = items[i].value.lower() == "not"
+        i += 1
+        if not (i < len(items) and isinstance(items[i], IdentToken)):
+            return NOT_ALL
+    if i < len(items) and isinstance(items[i], IdentToken):
+        media_type = items[i].value.lower()
+        if media_type in ("and", "not", "only"):
+            return NOT_ALL
+        i += 1
+        need_and = True
+    elif i == len(items):
+        return NOT_ALL
+    else:
+        need_and = False
+    features = set()
+    while i < len(items):
+        if need_and:
+            if not (isinstance(items[i], IdentToken) and items[i].value.lower() == "and"):
+                return NOT_ALL
+            i += 1
+        feature = parse_media_feature(items[i]) if i < len(items) else None
+        if feature is None:
+            return NOT_ALL
+        features.add(feature)
+        i += 1
+        need_and = True
+    return (negated, media_type, frozenset(features))
+
+
+# a normalized @media prelude: the set of its queries, any of which has to
+# match; case, whitespace, the order of features and their units don't
+# matter, so equivalent preludes come out equal
+def parse_media_query_list(prelude) -> frozenset:
+    queries = []
+    query = []
+    for item in prelude:
+        if isinstance(item, CommaToken):
+            queries.append(parse_media_query(query))
+            query = []
+        else:
+            query.append(item)
+    if not queries and not significant(query):
+        return ALL
+    queries.append(parse_media_query(query))
+    return frozenset(queries)
+
+
+def media_feature_matches(feature, environment: Environment) -> bool:
+    name, value = feature
+    actual = environment.width if name.endswith("width") else environment.resolution
+    if value is None:
+        return actual != 0
+    elif name.startswith("min-"):
+        return actual >= value
+    elif name.startswith("max-"):
+        return actual <= value
+    else:
+        return actual == value
+
+
+# shared by every index, so each distinct query list is evaluated once per
+# environment however many stylesheets use it
+@lru_cache(maxsize=4096)
+def media_query_list_matches(queries: frozenset, environment: Environment) -> bool:
+    for negated, media_type, features in queries:
+        matches = media_type in ("all", environment.media_type) and all(
+            media_feature_matches(feature, environment) for feature in features
+        )
+        if matches != negated:
+            return True
+    return False
+
+
+# the rules of a stylesheet with @media rules flattened away, grouped by the
+# media query lists (all of them, for nested @media) they are under; rules()
+# gives the ones that apply in an environment, in stylesheet order, and the
+# answer for each environment is kept
+class MediaIndex:
+    def __init__(self, stylesheet: Stylesheet):
+        self.runs = []  # (condition, [rule, ...]) for consecutive rules
+        self.groups = {}  # condition -> [rule, ...]
+        self.results = {}  # environment -> (rule, ...)
+        self.add_rules(stylesheet.value, frozenset())
+
+    def add_rules(self, rules, condition: frozenset) -> None:
+        for rule in rules:
+            if isinstance(rule, AtRule) and rule.name == "media":
+                self.add_rules(rule.value, condition | {parse_media_query_list(rule.prelude)})
+                continue
+            if self.runs and self.runs[-1][0] == condition:
+                self.runs[-1][1].append(rule)
+            else:
+                self.runs.append((condition, [rule]))
+            self.groups.setdefault(condition, []).append(rule)
+
+    def matches(self, condition: frozenset, environment: Environment) -> bool:
+        return all(media_query_list_matches(queries, environment) for queries in condition)
+
+    def rules(self, environment: Environment) -> tuple:
+        result = self.results.get(environment)
+        if result is None:
+            matching = {
+                condition: self.matches(condition, environment) for condition in self.groups
+            }
+            result = self.results[environment] = tuple(
+                rule for condition, rules in self.runs if matching[condition] for rule in rules
+            )
+        return result
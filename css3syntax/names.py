@@ -0,0 +1,95 @@
+from sys import intern
+
+# property names and keywords that real stylesheets repeat over and over;
+# they are interned up front, so Tokenizer(intern_names=True) hands out
+# these very objects and code built on the parser can compare names with
+# "is", e.g. declaration.name is NAMES["background-color"]
+PROPERTY_NAMES = """
+    align-content align-items align-self all animation animation-delay
+    animation-direction animation-duration animation-fill-mode
+    animation-iteration-count animation-name animation-play-state
+    animation-timing-function appearance aspect-ratio backdrop-filter
+    backface-visibility background background-attachment background-blend-mode
+    background-clip background-color background-image background-origin
+    background-position background-position-x background-position-y
+    background-repeat background-size block-size border border-block
+    border-block-end border-block-start border-bottom border-bottom-color
+    border-bottom-left-radius border-bottom-right-radius border-bottom-style
+    border-bottom-width border-collapse border-color border-image
+    border-image-outset border-image-repeat border-image-slice
+    border-image-source border-image-width border-inline border-inline-end
+    border-inline-start border-left border-left-color border-left-style
+    border-left-width border-radius border-right border-right-color
+    border-right-style border-right-width border-spacing border-style
+    border-top border-top-color border-top-left-radius border-top-right-radius
+    border-top-style border-top-width border-width bottom box-decoration-break
+    box-shadow box-sizing break-after break-before break-inside caption-side
+    caret-color clear clip clip-path color color-scheme column-count column-fill
+    column-gap column-rule column-rule-color column-rule-style column-rule-width
+    column-span column-width columns contain content content-visibility
+    counter-increment counter-reset counter-set cursor direction display
+    empty-cells fill filter flex flex-basis flex-direction flex-flow flex-grow
+    flex-shrink flex-wrap float font font-display font-family
+    font-feature-settings font-kerning font-size font-size-adjust font-stretch
+    font-style font-variant font-variant-ligatures font-variant-numeric
+    font-weight gap grid grid-area grid-auto-columns grid-auto-flow
+    grid-auto-rows grid-column grid-column-end grid-column-gap grid-column-start
+    grid-gap grid-row grid-row-end grid-row-gap grid-row-start grid-template
+    grid-template-areas grid-template-columns grid-template-rows height hyphens
+    image-rendering inline-size inset inset-block inset-inline isolation
+    justify-content justify-items justify-self left letter-spacing line-break
+    line-height list-style list-style-image list-style-position list-style-type
+    margin margin-block margin-block-end margin-block-start margin-bottom
+    margin-inline margin-inline-end margin-inline-start margin-left margin-right
+    margin-top mask mask-image max-block-size max-height max-inline-size
+    max-width min-block-size min-height min-inline-size min-width
+    mix-blend-mode object-fit object-position opacity order orphans outline
+    outline-color outline-offset outline-style outline-width overflow
+    overflow-anchor overflow-wrap overflow-x overflow-y overscroll-behavior
+    padding padding-block padding-block-end padding-block-start padding-bottom
+    padding-inline padding-inline-end padding-inline-start padding-left
+    padding-right padding-top page-break-after page-break-before
+    page-break-inside perspective perspective-origin place-content place-items
+    place-self pointer-events position quotes resize right rotate row-gap scale
+    scroll-behavior scroll-margin scroll-padding scroll-snap-align
+    scroll-snap-type scrollbar-color scrollbar-width shape-outside speak src
+    stroke stroke-width tab-size table-layout text-align text-align-last
+    text-decoration text-decoration-color text-decoration-line
+    text-decoration-style text-decoration-thickness text-indent text-justify
+    text-overflow text-rendering text-shadow text-transform
+    text-underline-offset text-underline-position top touch-action transform
+    transform-origin transform-style transition transition-delay
+    transition-duration transition-property transition-timing-function
+    translate unicode-bidi unicode-range user-select vertical-align visibility
+    white-space widows width will-change word-break word-spacing word-wrap
+    writing-mode z-index zoom
+""".split()
+
+KEYWORDS = """
+    absolute auto baseline block bold bolder border-box both bottom break-word
+    capitalize center circle clip collapse column column-reverse contain
+    content-box cover currentcolor dashed decimal default disc dotted double
+    ease ease-in ease-in-out ease-out ellipsis end fixed flex flex-end
+    flex-start forwards grid groove hidden important infinite inherit initial
+    inline inline-block inline-flex inline-grid inset italic justify large
+    larger left lighter line-through linear list-item lowercase medium middle
+    no-repeat none normal nowrap outset overline padding-box pointer pre
+    pre-line pre-wrap relative repeat repeat-x repeat-y revert ridge right row
+    row-reverse sans-serif scroll serif small smaller solid space-around
+    space-between space-evenly start static sticky stretch sub super table
+    table-cell table-row text-bottom text-top thick thin top transparent
+    underline unset uppercase visible wrap x-large x-small xx-large xx-small
+
+    black blue gray green grey orange purple red silver white yellow
+
+    attr calc clamp cubic-bezier hsl hsla linear-gradient max min
+    radial-gradient rgb rgba rotate scale steps translate translateX
+    translateY translate3d url var
+
+    charset counter-style font-face import keyframes media namespace page
+    supports
+
+    all and not only print screen orientation landscape portrait
+""".split()
+
+NAMES = {name: intern(name) for name in PROPERTY_NAMES + KEYWORDS}
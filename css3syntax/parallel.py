@@ -0,0 +1,132 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Generator, Iterable
+
+from .parser import Parser, Stylesheet
+from .tokenizer import ESCAPE, SingletonToken, SpanToken, Token, Tokenizer, decode_span
+
+# what the pre-scan has to step over so that brackets inside comments,
+# strings, unquoted urls and escapes are not counted
+SCAN_RE = re.compile(
+    r"""
+      /\*.*?(?:\*/|\Z)
+    | "(?:[^"\\\n]|\\.)*"?
+    | '(?:[^'\\\n]|\\.)*'?
+    | [uU](?<![-\w\\@#\x80-\U0010ffff].)[rR][lL]\([ \t\n]*+(?!["'])(?:[^)\\]|\\.)*\)?
+    | \\
+    | [{}()\[\]]
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+NAME_CHAR = r"[-\w\x80-\U0010ffff]"
+
+# an ident with an escape in it is matched whole from its first character,
+# since its name decides whether a "(" after it opens a url
+ESCAPED_NAME_RE = re.compile(f"(?:{NAME_CHAR}|{ESCAPE})*+", re.DOTALL)
+
+NAME_CHAR_RE = re.compile(NAME_CHAR)
+
+URL_TAIL_RE = re.compile(r"""[ \t\n]*+(?!["'])(?:[^)\\]|\\.)*\)?""", re.DOTALL)
+
+CLOSING = {"{": "}", "(": ")", "[": "]"}
+
+# below this many characters per chunk it isn't worth starting processes
+MINIMUM_CHUNK_SIZE = 1 << 16
+
+
+# offsets just past each "}" that closes a top-level block; once brackets
+# stop matching the parser could disagree with the scan, so no later offset
+# is safe
+def top_level_block_ends(s: str) -> Generator[int]:
+    stack = []
+    index = 0
+    while True:
+        m = SCAN_RE.search(s, index)
+        if m is None:
+            return
+        index = m.end()
+        ch = m.group()
+        if ch == "\\":
+            start = m.start()
+            while start > 0 and NAME_CHAR_RE.match(s, start - 1):
+                start -= 1
+            index = max(index, ESCAPED_NAME_RE.match(s, start).end())
+            if s[index : index + 1] == "(":
+                index += 1
+                url_tail = None
+                if (
+                    s[start - 1 : start] not in ("@", "#")
+                    and decode_span(s, start, index - 1).lower() == "url"
+                ):
+                    # a quoted argument makes it a function, as for the tokenizer
+                    url_tail = URL_TAIL_RE.match(s, index)
+                if url_tail is not None:
+                    index = url_tail.end()
+                else:
+                    stack.append(")")
+        elif ch in CLOSING:
+            stack.append(CLOSING[ch])
+        elif ch in "})]":
+            if not stack or stack.pop() != ch:
+                return
+            if ch == "}" and not stack:
+                yield index
+
+
+# at most one of the top-level block ends at or after each of the n - 1
+# evenly spaced targets
+def find_split_points(s: str, n: int) -> list[int]:
+    targets = [len(s) * i // n for i in range(1, n)]
+    points = []
+    for index in top_level_block_ends(s):
+        if not targets:
+            break
+        if index >= targets[0]:
+            points.append(index)
+            while targets and targets[0] <= index:
+                del targets[0]
+    return points
+
+
+# tokens only keep a chunk-relative span and position, so values are decoded
+# here and the offsets moved to the whole stylesheet before the result is
+# sent back
+def shift_tokens(tokens: Iterable[Token], offset: int) -> Generator[Token]:
+    for token in tokens:
+        if isinstance(token, SpanToken):
+            token.value
+            token.start += offset
+            token.end += offset
+        if not isinstance(token, SingletonToken):
+            token.position += offset
+        yield token
+
+
+def parse_chunk(args) -> tuple:
+    s, offset, unicode_ranges_allowed = args
+    tokens = Tokenizer(unicode_ranges_allowed, fast=True).tokenize(s)
+    return Parser(shift_tokens(tokens, offset)).parse().value
+
+
+# parses top-level rules in a process pool, one chunk per worker, and joins
+# them in order into a single Stylesheet
+def parse_parallel(
+    s: str, max_workers: int | None = None, unicode_ranges_allowed: bool = False
+) -> Stylesheet:
+    if max_workers is None:
+        from os import cpu_count
+
+        max_workers = cpu_count() or 1
+    n = max(1, min(max_workers, len(s) // MINIMUM_CHUNK_SIZE))
+    bounds = [0] + find_split_points(s, n) + [len(s)]
+    chunks = [(s[a:b], a, unicode_ranges_allowed) for a, b in zip(bounds, bounds[1:])]
+
+    stylesheet = Stylesheet()
+    if len(chunks) == 1:
+        stylesheet.value = parse_chunk(chunks[0])
+        return stylesheet
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        stylesheet.value = tuple(chain.from_iterable(executor.map(parse_chunk, chunks)))
+    return stylesheet
@@ -1,3 +1,28 @@
+from weakref import WeakValueDictionary
+
+from . import instrument
+from .tokenizer import (
+    AtKeywordToken,
+    CdcToken,
+    CdoToken,
+    CloseCurlyToken,
+    CloseParen,
+    CloseSquareToken,
+    ColonToken,
+    CommaToken,
+    DelimToken,
+    EofToken,
+    FunctionToken,
+    IdentToken,
+    OpenCurlyToken,
+    OpenParen,
+    OpenSquareToken,
+    SemicolonToken,
+    Token,
+    WhitespaceToken,
+    token_key,
+)
+
 TOP_LEVEL_MODE = 1
 AT_RULE_MODE = 2
 RULE_MODE = 3
@@ -9,21 +34,64 @@ DECLARATION_END_MODE = 8
 NEXT_BLOCK_ERROR_MODE = 9
 NEXT_DECLARATION_ERROR_MODE = 10
 
+# bump whenever Parser builds a different tree for some input, so that trees
+# saved by an older parser (see cache.DiskCache) are not loaded
+PARSER_VERSION = 1
+
+RULE_FILLED_AT_RULES = ["media", "supports", "document", "keyframes"]
+DECLARATION_FILLED_AT_RULES = ["page", "font-face", "counter-style", "viewport"]
+
+EOF_TOKEN = EofToken()
+
+MODE_METHODS = {
+    TOP_LEVEL_MODE: "top_level_mode",
+    AT_RULE_MODE: "at_rule_mode",
+    RULE_MODE: "rule_mode",
+    SELECTOR_MODE: "selector_mode",
+    DECLARATION_MODE: "declaration_mode",
+    AFTER_DECLARATION_NAME_MODE: "after_declaration_name_mode",
+    DECLARATION_VALUE_MODE: "declaration_value_mode",
+    NEXT_DECLARATION_ERROR_MODE: "next_declaration_error_mode",
+}
+
+ENDING_TOKENS = {
+    OpenCurlyToken: CloseCurlyToken,
+    OpenSquareToken: CloseSquareToken,
+    OpenParen: CloseParen,
+}
+
+
+# a node's children are tuples once it is finished, and a token that isn't
+# part of a block or function is stored as it is
+def pretty_print_item(item, indent):
+    if isinstance(item, Token):
+        print("  " * indent, item)
+    else:
+        item.pretty_print(indent)
+
 
 class Stylesheet:
+    __slots__ = ("value", "chunks")
 
     content_mode = TOP_LEVEL_MODE
 
+    # chunks is only set by incremental.reparse, see there
     def __init__(self):
         self.value = []
+        self.chunks = None
+
+    def freeze(self):
+        self.value = tuple(self.value)
 
     def pretty_print(self):
-        print "Stylesheet:"
+        print("Stylesheet:")
         for item in self.value:
-            item.pretty_print(1)
+            pretty_print_item(item, 1)
 
 
 class AtRule:
+    __slots__ = ("name", "prelude", "value", "__weakref__")
+
     def __init__(self, name):
         self.name = name
         self.prelude = []
@@ -31,95 +99,189 @@ class AtRule:
 
     @property
     def content_mode(self):
-        if self.name in ["media"]:  # rule-filled
+        if self.name in RULE_FILLED_AT_RULES:
             return RULE_MODE
-        elif self.name in ["page"]:  # declaration-filled
+        elif self.name in DECLARATION_FILLED_AT_RULES:
             return DECLARATION_MODE
         else:
             raise NotImplementedError
 
+    def freeze(self):
+        self.prelude = tuple(self.prelude)
+        self.value = tuple(self.value)
+
     def pretty_print(self, indent):
         i = "  " * indent
-        print i, "AtRule:"
-        print i, "  Name:", self.name
-        print i, "  Prelude:"
+        print(i, "AtRule:")
+        print(i, "  Name:", self.name)
+        print(i, "  Prelude:")
         for item in self.prelude:
-            item.pretty_print(indent + 2)
-        print i, "  Value:"
+            pretty_print_item(item, indent + 2)
+        print(i, "  Value:")
         for item in self.value:
-            item.pretty_print(indent + 2)
+            pretty_print_item(item, indent + 2)
 
 
 class StyleRule:
+    __slots__ = ("selector", "_value", "block_tokens", "__weakref__")
 
     content_mode = DECLARATION_MODE
 
     def __init__(self):
         self.selector = []
-        self.value = []
+        self._value = []
+        self.block_tokens = None
+
+    # a rule from a lazy parse keeps the tokens of its block until this is
+    # first read
+    @property
+    def value(self):
+        if self.block_tokens is not None:
+            tokens = self.block_tokens
+            self.block_tokens = None
+            Parser(tokens).parse_declaration_list(self)
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self.block_tokens = None
+        self._value = value
+
+    def freeze(self):
+        self.selector = tuple(self.selector)
+        if self.block_tokens is None:
+            self._value = tuple(self._value)
 
     def pretty_print(self, indent):
         i = "  " * indent
-        print i, "StyleRule:"
-        print i, "  Selector:"
+        print(i, "StyleRule:")
+        print(i, "  Selector:")
         for item in self.selector:
-            item.pretty_print(indent + 2)
-        print i, "  Value:"
+            pretty_print_item(item, indent + 2)
+        print(i, "  Value:")
         for item in self.value:
-            item.pretty_print(indent + 2)
+            pretty_print_item(item, indent + 2)
 
 
 class Declaration:
+    __slots__ = ("name", "value", "important", "__weakref__")
+
     def __init__(self, name):
         self.name = name
         self.value = []
+        self.important = False
 
     def pretty_print(self, indent):
         i = "  " * indent
-        print i, "Declaration:"
-        print i, "  Name:", self.name
-        print i, "  Value:"
+        print(i, "Declaration:")
+        print(i, "  Name:", self.name)
+        if self.important:
+            print(i, "  Important")
+        print(i, "  Value:")
         for item in self.value:
-            item.pretty_print(indent + 2)
-
-
-class Primitive:
-    def __init__(self, primitive):
-        self.primitive = primitive
-
-    def pretty_print(self, indent):
-        i = "  " * indent
-        print i, self.primitive
+            pretty_print_item(item, indent + 2)
 
 
 class Function:
+    __slots__ = ("name", "arguments")
+
     def __init__(self, name):
         self.name = name
         self.arguments = []
 
     def pretty_print(self, indent):
         i = "  " * indent
-        print i, "Function:"
-        print i, "  Name:", self.name
-        print i, "  Arguments:"
+        print(i, "Function:")
+        print(i, "  Name:", self.name)
+        print(i, "  Arguments:")
         for argument in self.arguments:
-            print i, "  -"
+            print(i, "  -")
             for item in argument:
-                item.pretty_print(indent + 2)
+                pretty_print_item(item, indent + 2)
 
 
 class SimpleBlock:
+    __slots__ = ("associated_token", "value")
+
     def __init__(self, associated_token):
         self.associated_token = associated_token
         self.value = []
 
     def pretty_print(self, indent):
         i = "  " * indent
-        print i, "SimpleBlock:"
-        print i, "  AssociatedToken:", self.associated_token
-        print i, "  Value:"
+        print(i, "SimpleBlock:")
+        print(i, "  AssociatedToken:", self.associated_token)
+        print(i, "  Value:")
         for item in self.value:
-            item.pretty_print(indent + 2)
+            pretty_print_item(item, indent + 2)
+
+
+# finished nodes by their content, for Parser(hash_cons=True), and a style
+# rule for each distinct block, whose value tuple other rules can share; the
+# nodes are shared by every stylesheet that has them, so mustn't be changed,
+# and their tokens' positions are from whichever stylesheet had them first
+INTERNED_NODES = WeakValueDictionary()
+INTERNED_BLOCKS = WeakValueDictionary()
+
+
+# what identifies a node's content: tokens by token_key, which unlike ==
+# tells 1% from 1.0%, and declarations and rules (already interned, and kept
+# alive by whatever the key is for) by identity
+def content_key(items) -> tuple:
+    return tuple([item_content_key(item) for item in items])
+
+
+def item_content_key(item):
+    if isinstance(item, Token):
+        return token_key(item)
+    elif isinstance(item, Function):
+        return (Function, item.name, tuple(map(content_key, item.arguments)))
+    elif isinstance(item, SimpleBlock):
+        return (SimpleBlock, type(item.associated_token), content_key(item.value))
+    else:
+        return id(item)
+
+
+# the interned node with the same content as a finished one, which becomes
+# that node if there is none yet; a style rule from a lazy parse is left as
+# it is while its block is pending
+def intern_node(node):
+    if isinstance(node, Declaration):
+        key = (Declaration, node.name, node.important, content_key(node.value))
+    elif isinstance(node, StyleRule):
+        if node.block_tokens is not None:
+            return node
+        block_key = content_key(node.value)
+        key = (StyleRule, content_key(node.selector), block_key)
+        interned = INTERNED_NODES.get(key)
+        if interned is not None:
+            return interned
+        interned_block = INTERNED_BLOCKS.get(block_key)
+        if interned_block is None:
+            INTERNED_BLOCKS[block_key] = node
+        else:
+            node.value = interned_block.value
+    else:
+        key = (AtRule, node.name, content_key(node.prelude), content_key(node.value))
+    return INTERNED_NODES.setdefault(key, node)
+
+
+# what Parser calls, in place of building a tree, when given a handler; a
+# rule's prelude or selector is complete when it starts, and its contents go
+# to the handler rather than into its value (which only ever holds the block
+# of an at-rule the parser doesn't know)
+class ParseHandler:
+    def start_at_rule(self, rule):
+        pass
+
+    def start_style_rule(self, rule):
+        pass
+
+    def declaration(self, declaration):
+        pass
+
+    def end_rule(self, rule):
+        pass
 
 
 # NOTE: the goal of this parser is not to be elegant or fast but rather to
@@ -127,25 +289,59 @@ class SimpleBlock:
 
 class Parser:
 
-    def __init__(self, tokens):
-        self.index = 0
-        self.tokens = tokens
+    # tokens can be any iterable, typically Tokenizer.tokenize() itself, and
+    # are pulled one at a time; running out counts as the EOF token. when lazy,
+    # a style rule's block is only collected, see StyleRule.value. without an
+    # instrumentation, the one made active by instrument.instrumented() is used.
+    # with hash_cons, declarations and rules are shared, see intern_node
+    def __init__(self, tokens, handler=None, lazy=False, instrumentation=None, hash_cons=False):
+        if instrumentation is None:
+            instrumentation = instrument.ACTIVE
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            tokens = instrumentation.count_tokens(tokens)
+        self.tokens = iter(tokens)
+        self.handler = handler
+        self.lazy = lazy and handler is None
+        self.hash_cons = hash_cons and handler is None
+        self.current_input_token = None
+        self.reprocessing = False
         self.mode = TOP_LEVEL_MODE
         self.open_rule_stack = [Stylesheet()]
+        self.current_declaration = None
 
     def consume_next_input_token(self):
-        token = self.tokens[self.index]
-        self.index += 1
-        return token
+        if self.reprocessing:
+            self.reprocessing = False
+        else:
+            self.current_input_token = next(self.tokens, EOF_TOKEN)
+        return self.current_input_token
 
     def reprocess_current_input_token(self):
-        self.index -= 1
+        self.reprocessing = True
 
     def current_rule(self):
         return self.open_rule_stack[-1]
 
+    # whether the current rule is inside another rule's block, where a "}"
+    # can't be part of its prelude or selector, so that blocks always nest
+    # as their braces do
+    def nested(self):
+        return not isinstance(self.open_rule_stack[-2], Stylesheet)
+
     def parse(self):
-        while self.index < len(self.tokens):
+        if self.instrumentation is None:
+            self.consume_input()
+        else:
+            with self.instrumentation.phase("parse"):
+                self.consume_input_instrumented()
+        self.open_rule_stack[0].freeze()
+        return self.open_rule_stack[0]
+
+    def consume_input(self):
+        while not (
+            isinstance(self.current_input_token, EofToken) and not self.reprocessing
+        ):
             if self.mode == TOP_LEVEL_MODE:
                 self.top_level_mode()
             elif self.mode == AT_RULE_MODE:
@@ -160,22 +356,43 @@ class Parser:
                 self.after_declaration_name_mode()
             elif self.mode == DECLARATION_VALUE_MODE:
                 self.declaration_value_mode()
+            elif self.mode == NEXT_DECLARATION_ERROR_MODE:
+                self.next_declaration_error_mode()
             else:
-                print "UNKNOWN MODE", self.mode
+                print("UNKNOWN MODE", self.mode)
                 break
 
+    # the same loop, with each step timed under the name of its mode
+    def consume_input_instrumented(self):
+        while not (
+            isinstance(self.current_input_token, EofToken) and not self.reprocessing
+        ):
+            name = MODE_METHODS.get(self.mode)
+            if name is None:
+                print("UNKNOWN MODE", self.mode)
+                break
+            self.instrumentation.run_mode(name, getattr(self, name))
+
+    # parses the tokens as the contents of a declaration block, e.g. a style
+    # attribute, and returns the declarations; with no rule of its own to
+    # close, a "}" is then just a parse error
+    def parse_declaration_list(self, rule=None):
+        self.open_rule_stack = [StyleRule() if rule is None else rule]
+        self.mode = DECLARATION_MODE
+        return self.parse().value
+
     def top_level_mode(self):
         token = self.consume_next_input_token()
 
-        if token[0] == "cdo" or token[0] == "cdc" or token[0] == "whitespace":
+        if isinstance(token, (CdoToken, CdcToken, WhitespaceToken)):
             pass
-        elif token[0] == "at":
-            self.open_rule_stack.append(AtRule(name=token[1]))
+        elif isinstance(token, AtKeywordToken):
+            self.open_rule_stack.append(AtRule(name=token.value))
             self.mode = AT_RULE_MODE
-        elif token[0] == "{":
+        elif isinstance(token, OpenCurlyToken):
             # @@@ parse error
             self.consume_primitive(token)
-        elif token[0] == "EOF":
+        elif isinstance(token, EofToken):
             self.finish_parsing()
         else:
             self.open_rule_stack.append(StyleRule())
@@ -185,34 +402,48 @@ class Parser:
     def at_rule_mode(self):
         token = self.consume_next_input_token()
 
-        if token[0] == "semicolon":
+        if isinstance(token, SemicolonToken):
+            self.start_current_at_rule()
             self.pop_current_rule()
             self.switch_to_current_rule_content_mode()
-        elif token[0] == "{":
-            if self.current_rule().name in ["media"]:  # rule-filled
+        elif isinstance(token, OpenCurlyToken):
+            self.start_current_at_rule()
+            if self.current_rule().name in RULE_FILLED_AT_RULES:
                 self.mode = RULE_MODE
-            elif self.current_rule().name in ["page"]:  # declaration-filled
+            elif self.current_rule().name in DECLARATION_FILLED_AT_RULES:
                 self.mode = DECLARATION_MODE
             else:
-                # @@@ parse error
-                raise NotImplementedError
-        elif token[0] == "EOF":
-            raise NotImplementedError
+                # @@@ unknown at-rule, keep its block unparsed
+                self.current_rule().value.append(self.consume_simple_block(token))
+                self.pop_current_rule()
+                self.switch_to_current_rule_content_mode()
+        elif isinstance(token, CloseCurlyToken) and self.nested():
+            # @@@ parse error, the "}" ends the block the at-rule is in
+            self.start_current_at_rule()
+            self.pop_current_rule()
+            self.switch_to_current_rule_content_mode()
+            self.reprocess_current_input_token()
+        elif isinstance(token, EofToken):
+            # @@@ parse error
+            self.start_current_at_rule()
+            self.finish_parsing()
         else:
             self.current_rule().prelude.append(self.consume_primitive(token))
 
     def rule_mode(self):
         token = self.consume_next_input_token()
 
-        if token[0] == "whitespace":
+        if isinstance(token, WhitespaceToken):
             pass
-        elif token[0] == "}":
+        elif isinstance(token, CloseCurlyToken):
             self.pop_current_rule()
             self.switch_to_current_rule_content_mode()
-        elif token[0] == "at":
-            raise NotImplementedError
-        elif token[0] == "EOF":
-            raise NotImplementedError
+        elif isinstance(token, AtKeywordToken):
+            self.open_rule_stack.append(AtRule(name=token.value))
+            self.mode = AT_RULE_MODE
+        elif isinstance(token, EofToken):
+            # @@@ parse error
+            self.finish_parsing()
         else:
             self.open_rule_stack.append(StyleRule())
             self.mode = SELECTOR_MODE
@@ -221,10 +452,24 @@ class Parser:
     def selector_mode(self):
         token = self.consume_next_input_token()
 
-        if token[0] == "{":
+        if isinstance(token, OpenCurlyToken):
+            self.current_rule().selector = tuple(self.current_rule().selector)
+            if self.lazy:
+                self.current_rule().block_tokens = self.consume_block_tokens()
+                self.pop_current_rule()
+                self.switch_to_current_rule_content_mode()
+                return
+            if self.handler is not None:
+                self.handler.start_style_rule(self.current_rule())
             self.mode = DECLARATION_MODE
-        elif token[0] == "EOF":
+        elif isinstance(token, CloseCurlyToken) and self.nested():
+            # @@@ parse error, discard current rule and end the block it is in
+            self.open_rule_stack.pop()
+            self.switch_to_current_rule_content_mode()
+            self.reprocess_current_input_token()
+        elif isinstance(token, EofToken):
             # discard current rule
+            self.open_rule_stack.pop()
             self.finish_parsing()
         else:
             self.current_rule().selector.append(self.consume_primitive(token))
@@ -232,99 +477,185 @@ class Parser:
     def declaration_mode(self):
         token = self.consume_next_input_token()
 
-        if token[0] == "whitespace" or token[0] == "semicolon":
+        if isinstance(token, (WhitespaceToken, SemicolonToken)):
             pass
-        elif token[0] == "}":
+        elif isinstance(token, CloseCurlyToken) and len(self.open_rule_stack) > 1:
             self.pop_current_rule()
-            self.switch_to_current_rule_content_mode
-        elif token[0] == "at_rule":
-            raise NotImplementedError
-        elif token[0] == "identifier":
-            self.current_declaration = Declaration(name=token[1])
+            self.switch_to_current_rule_content_mode()
+        elif isinstance(token, AtKeywordToken):
+            self.open_rule_stack.append(AtRule(name=token.value))
+            self.mode = AT_RULE_MODE
+        elif isinstance(token, IdentToken):
+            self.current_declaration = Declaration(name=token.value)
             self.mode = AFTER_DECLARATION_NAME_MODE
-        elif token[0] == "EOF":
+        elif isinstance(token, EofToken):
             self.finish_parsing()
         else:
             # @@@ parse error
             self.current_declaration = None
             self.mode = NEXT_DECLARATION_ERROR_MODE
+            self.reprocess_current_input_token()
 
     def after_declaration_name_mode(self):
         token = self.consume_next_input_token()
 
-        if token[0] == "whitespace":
+        if isinstance(token, WhitespaceToken):
             pass
-        elif token[0] == "colon":
+        elif isinstance(token, ColonToken):
             self.mode = DECLARATION_VALUE_MODE
-        elif token[0] == "semicolon":
+        elif isinstance(token, SemicolonToken):
             # @@@ parse error
             self.current_declaration = None
             self.switch_to_current_rule_content_mode()
-        elif token[0] == "EOF":
+        elif isinstance(token, EofToken):
             self.current_declaration = None
             self.finish_parsing()
         else:
             # @@@ parse error
             self.current_declaration = None
             self.mode = NEXT_DECLARATION_ERROR_MODE
+            self.reprocess_current_input_token()
 
     def declaration_value_mode(self):
         token = self.consume_next_input_token()
 
-        if token == ("delim", "!"):
-            raise NotImplementedError
-        elif token[0] == "semicolon":
+        if isinstance(token, SemicolonToken):
             # @@@ if grammatically valid
-            self.current_rule().value.append(self.current_declaration)
+            self.finish_declaration()
             self.switch_to_current_rule_content_mode()
-        elif token[0] == "}":
+        elif isinstance(token, CloseCurlyToken) and len(self.open_rule_stack) > 1:
             # @@@ if grammatically valid
-            self.current_rule().value.append(self.current_declaration)
+            self.finish_declaration()
             self.pop_current_rule()
             self.switch_to_current_rule_content_mode()
-        elif token[0] == "EOF":
+        elif isinstance(token, EofToken):
+            self.finish_declaration()
             self.finish_parsing()
         else:
             self.current_declaration.value.append(self.consume_primitive(token))
 
+    def next_declaration_error_mode(self):
+        token = self.consume_next_input_token()
+
+        if isinstance(token, SemicolonToken):
+            self.switch_to_current_rule_content_mode()
+        elif isinstance(token, CloseCurlyToken) and len(self.open_rule_stack) > 1:
+            self.pop_current_rule()
+            self.switch_to_current_rule_content_mode()
+        elif isinstance(token, EofToken):
+            self.finish_parsing()
+        else:
+            self.consume_primitive(token)
+
     def consume_primitive(self, token):
-        if token[0] == "{" or token[0] == "[" or token == "(":
+        if isinstance(token, (OpenCurlyToken, OpenSquareToken, OpenParen)):
             return self.consume_simple_block(token)
-        elif token[0] == "function":
+        elif isinstance(token, FunctionToken):
             return self.consume_function(token)
         else:
-            return Primitive(token)
+            return token
 
     def consume_simple_block(self, token):
-        ending_token = {
-            "[": "]",
-            # @@@
-        }[token[0]]
+        ending_token = ENDING_TOKENS[type(token)]
         current_block = SimpleBlock(token)
         while True:
             token = self.consume_next_input_token()
-            if token[0] == "EOF" or token[0] == ending_token:
+            if isinstance(token, (EofToken, ending_token)):
+                if isinstance(token, EofToken):
+                    self.reprocess_current_input_token()
+                current_block.value = tuple(current_block.value)
                 return current_block
             else:
                 current_block.value.append(self.consume_primitive(token))
 
+    # the tokens up to the "}" that closes a block, which is consumed but not
+    # returned; brackets nest as they would in consume_simple_block, and since
+    # a "}" in a block always ends it (see nested), this is where parsing the
+    # block would end too
+    def consume_block_tokens(self):
+        tokens = []
+        closing = [CloseCurlyToken]
+        while True:
+            token = self.consume_next_input_token()
+            token_type = type(token)
+            if token_type is closing[-1]:
+                closing.pop()
+                if not closing:
+                    return tuple(tokens)
+            elif token_type in ENDING_TOKENS:
+                closing.append(ENDING_TOKENS[token_type])
+            elif token_type is FunctionToken:
+                closing.append(CloseParen)
+            elif token_type is EofToken:
+                self.reprocess_current_input_token()
+                return tuple(tokens)
+            tokens.append(token)
+
     def consume_function(self, token):
-        function = Function(token[1])
+        function = Function(token.value)
         current_argument = []
         while True:
             token = self.consume_next_input_token()
-            if token[0] == "EOF" or token[0] == ")":
-                function.arguments.append(current_argument)
+            if isinstance(token, (EofToken, CloseParen)):
+                if isinstance(token, EofToken):
+                    self.reprocess_current_input_token()
+                function.arguments.append(tuple(current_argument))
+                function.arguments = tuple(function.arguments)
                 return function
-            elif token == ("delim", ","):
-                function.arguments.append(current_argument)
+            elif isinstance(token, CommaToken):
+                function.arguments.append(tuple(current_argument))
                 current_argument = []
             else:
                 current_argument.append(self.consume_primitive(token))
 
+    # a trailing "!important" is taken off the value and flagged instead
+    def finish_declaration(self):
+        declaration = self.current_declaration
+        significant = [
+            i
+            for i, item in enumerate(declaration.value)
+            if not isinstance(item, WhitespaceToken)
+        ]
+        if len(significant) >= 2:
+            bang = declaration.value[significant[-2]]
+            name = declaration.value[significant[-1]]
+            if (
+                isinstance(bang, DelimToken) and bang.value == "!" and
+                isinstance(name, IdentToken) and name.value.lower() == "important"
+            ):
+                del declaration.value[significant[-2]:]
+                declaration.important = True
+        declaration.value = tuple(declaration.value)
+        if self.hash_cons:
+            declaration = intern_node(declaration)
+        if self.handler is None:
+            self.current_rule().value.append(declaration)
+        else:
+            self.handler.declaration(declaration)
+        self.current_declaration = None
+
+    # closes every rule that is still open once the EOF token is reached
+    def finish_parsing(self):
+        self.current_declaration = None
+        while len(self.open_rule_stack) > 1:
+            self.pop_current_rule()
+        self.mode = TOP_LEVEL_MODE
+
     def switch_to_current_rule_content_mode(self):
         self.mode = self.current_rule().content_mode
 
+    def start_current_at_rule(self):
+        rule = self.current_rule()
+        rule.prelude = tuple(rule.prelude)
+        if self.handler is not None:
+            self.handler.start_at_rule(rule)
+
     def pop_current_rule(self):
         rule = self.open_rule_stack.pop()
-        self.current_rule().value.append(rule)
+        rule.freeze()
+        if self.hash_cons:
+            rule = intern_node(rule)
+        if self.handler is None:
+            self.current_rule().value.append(rule)
+        else:
+            self.handler.end_rule(rule)
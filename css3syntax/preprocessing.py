@@ -0,0 +1,99 @@
+import codecs
+import re
+
+# 3.2
+CHARSET_RE = re.compile(rb'@charset "([^";]*)";')
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+]
+
+# 3.3
+PREPROCESS_TABLE = str.maketrans({"\r": "\n", "\f": "\n", "\u0000": "\ufffd"})
+
+SURROGATE_RE = re.compile("[\ud800-\udfff]")
+
+
+def get_an_encoding(label: str) -> str | None:
+    try:
+        return codecs.lookup(label.strip()).name
+    except LookupError:
+        return None
+
+
+# 3.2, returns the encoding and the length of any BOM
+def determine_the_encoding(data, fallback: str = "utf-8") -> tuple[str, int]:
+    view = memoryview(data)
+    head = bytes(view[:3])
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    m = CHARSET_RE.match(view[:1024])
+    if m:
+        encoding = get_an_encoding(m.group(1).decode("ascii", "replace"))
+        # a stylesheet that could declare it isn't UTF-16, whatever its label
+        if encoding in ("utf-16", "utf-16-be", "utf-16-le"):
+            return "utf-8", 0
+        elif encoding is not None:
+            return encoding, 0
+    return fallback, 0
+
+
+# decodes bytes, a memoryview or an mmap in one go, without first copying
+# it into a bytes object
+def decode(data, fallback: str = "utf-8") -> str:
+    encoding, bom_length = determine_the_encoding(data, fallback)
+    return str(memoryview(data)[bom_length:], encoding, "replace")
+
+
+# 3.3, each step is a whole-string operation that is skipped (so returns the
+# string itself) when there is nothing for it to do
+def preprocess(data, fallback: str = "utf-8") -> str:
+    if isinstance(data, str):
+        s = data
+        if SURROGATE_RE.search(s):
+            s = SURROGATE_RE.sub("\ufffd", s)
+    else:
+        s = decode(data, fallback)  # errors are already replaced
+    if "\r" in s:
+        s = s.replace("\r\n", "\n")
+    if "\r" in s or "\f" in s or "\u0000" in s:
+        s = s.translate(PREPROCESS_TABLE)
+    return s
+
+
+# wraps a binary or text file object (or an mmap) so that read() returns
+# decoded, preprocessed text; a trailing CR is held back until the next read
+# shows whether it starts a CRLF
+class PreprocessingReader:
+    def __init__(self, f, fallback: str = "utf-8"):
+        self.f = f
+        self.fallback = fallback
+        self.decoder = None
+        self.pending = ""
+
+    def read(self, size: int) -> str:
+        while True:
+            data = self.f.read(size)
+            if isinstance(data, str):
+                s = data
+            else:
+                if self.decoder is None:
+                    # an @charset rule can be anywhere in the first 1024 bytes
+                    if data and len(data) < 1024:
+                        data += self.f.read(1024 - len(data))
+                    encoding, bom_length = determine_the_encoding(data, self.fallback)
+                    self.decoder = codecs.getincrementaldecoder(encoding)("replace")
+                    data = data[bom_length:] if data else data
+                s = self.decoder.decode(data, final=not data)
+            s = self.pending + s
+            self.pending = ""
+            if data and s.endswith("\r"):
+                self.pending = "\r"
+                s = s[:-1]
+            s = preprocess(s)
+            # an empty string means the end of the input to the caller
+            if s or not data:
+                return s
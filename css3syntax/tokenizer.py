@@ -1,64 +1,139 @@
-from dataclasses import dataclass
-from typing import Generator, Literal
+import codecs
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from sys import intern
+from typing import IO, Generator, Iterable, Literal
+
+MAXIMUM_ALLOWED_CODE_POINT = 0x10FFFF
+
+# code point classes are bit flags, so a single table lookup answers every
+# predicate below
+
+DIGIT = 0x001
+HEX_DIGIT = 0x002
+UPPERCASE_LETTER = 0x004
+LOWERCASE_LETTER = 0x008
+IDENT_START = 0x010
+IDENT = 0x020
+NON_PRINTABLE = 0x040
+NEWLINE = 0x080
+WHITESPACE = 0x100
+
+NON_ASCII_IDENT_RANGES = [
+    (0x00B7, 0x00B7),
+    (0x00C0, 0x00D6),
+    (0x00D8, 0x00F6),
+    (0x00F8, 0x037D),
+    (0x037F, 0x1FFF),
+    (0x200C, 0x200D),
+    (0x203F, 0x2040),
+    (0x2070, 0x218F),
+    (0x2C00, 0x2FEF),
+    (0x3001, 0xD7FF),
+    (0xF900, 0xFDCF),
+    (0xFDF0, 0xFFFD),
+    (0x10000, MAXIMUM_ALLOWED_CODE_POINT),
+]
+
+
+def build_latin1_classes() -> list[int]:
+    classes = [0] * 0x100
+    for code_point in range(0x100):
+        ch = chr(code_point)
+        if "0" <= ch <= "9":
+            classes[code_point] |= DIGIT | HEX_DIGIT | IDENT
+        if "A" <= ch <= "F" or "a" <= ch <= "f":
+            classes[code_point] |= HEX_DIGIT
+        if "A" <= ch <= "Z":
+            classes[code_point] |= UPPERCASE_LETTER | IDENT_START | IDENT
+        if "a" <= ch <= "z":
+            classes[code_point] |= LOWERCASE_LETTER | IDENT_START | IDENT
+        if (
+            code_point <= 0x08
+            or code_point == 0x0B
+            or 0x0E <= code_point <= 0x1F
+            or code_point == 0x7F
+        ):
+            classes[code_point] |= NON_PRINTABLE
+    for first, last in NON_ASCII_IDENT_RANGES:
+        for code_point in range(first, min(last, 0xFF) + 1):
+            classes[code_point] |= IDENT_START | IDENT
+    classes[ord("_")] |= IDENT_START | IDENT
+    classes[ord("-")] |= IDENT
+    classes[ord("\n")] |= NEWLINE | WHITESPACE
+    classes[ord("\t")] |= WHITESPACE
+    classes[ord(" ")] |= WHITESPACE
+    return classes
+
+
+def build_non_latin1_classes() -> tuple[list[int], list[int]]:
+    # above U+00FF the only distinction is ident or not, so store the starts
+    # of alternating runs and bisect
+    starts = [0x100]
+    classes = [0]
+    for first, last in NON_ASCII_IDENT_RANGES:
+        if last < 0x100:
+            continue
+        first = max(first, 0x100)
+        if first == starts[-1]:
+            classes[-1] = IDENT_START | IDENT
+        else:
+            starts.append(first)
+            classes.append(IDENT_START | IDENT)
+        starts.append(last + 1)
+        classes.append(0)
+    return starts, classes
+
+
+LATIN1_CLASSES = build_latin1_classes()
+NON_LATIN1_STARTS, NON_LATIN1_CLASSES = build_non_latin1_classes()
+
+
+def code_point_class(ch: str) -> int:
+    if not ch:
+        return 0
+    code_point = ord(ch)
+    if code_point < 0x100:
+        return LATIN1_CLASSES[code_point]
+    return NON_LATIN1_CLASSES[bisect_right(NON_LATIN1_STARTS, code_point) - 1]
 
 
 def is_digit(ch: str) -> bool:
-    return "0" <= ch <= "9"
+    return bool(code_point_class(ch) & DIGIT)
 
 
 def is_hex_digit(ch: str) -> bool:
-    return is_digit(ch) or "A" <= ch <= "F" or "a" <= ch <= "f"
+    return bool(code_point_class(ch) & HEX_DIGIT)
 
 
 def is_uppercase_letter(ch: str) -> bool:
-    return "A" <= ch <= "Z"
+    return bool(code_point_class(ch) & UPPERCASE_LETTER)
 
 
 def is_lowercase_letter(ch: str) -> bool:
-    return "a" <= ch <= "z"
+    return bool(code_point_class(ch) & LOWERCASE_LETTER)
 
 
 def is_letter(ch: str) -> bool:
-    return is_uppercase_letter(ch) or is_lowercase_letter(ch)
+    return bool(code_point_class(ch) & (UPPERCASE_LETTER | LOWERCASE_LETTER))
 
 
 def is_non_ascii_ident_code_point(ch: str) -> bool:
-    return any(
-        [
-            ch == "\u00b7",
-            "\u00c0" <= ch <= "\u00d6",
-            "\u00d8" <= ch <= "\u00f6",
-            "\u00f8" <= ch <= "\u037d",
-            "\u037f" <= ch <= "\u1fff",
-            "\u200c" <= ch <= "\u200d",
-            "\u203f" <= ch <= "\u2040",
-            "\u2070" <= ch <= "\u218f",
-            "\u2c00" <= ch <= "\u2fef",
-            "\u3001" <= ch <= "\ud7ff",
-            "\uf900" <= ch <= "\ufdcf",
-            "\ufdf0" <= ch <= "\ufffd",
-            ch >= "\U00010000",
-        ]
-    )
+    return ch >= "\u0080" and bool(code_point_class(ch) & IDENT_START)
 
 
 def is_ident_start_code_point(ch: str) -> bool:
-    return is_letter(ch) or is_non_ascii_ident_code_point(ch) or ch == "\u005f"  # _
+    return bool(code_point_class(ch) & IDENT_START)
 
 
 def is_ident_code_point(ch: str) -> bool:
-    return is_ident_start_code_point(ch) or is_digit(ch) or ch == "\u002d"  # -
+    return bool(code_point_class(ch) & IDENT)
 
 
 def is_non_printable_code_point(ch: str) -> bool:
-    return any(
-        [
-            "\u0000" <= ch <= "\u0008",
-            ch == "\u000b",
-            "\u000e" <= ch <= "\u001f",
-            ch == "\u007f",
-        ]
-    )
+    return bool(code_point_class(ch) & NON_PRINTABLE)
 
 
 def is_newline(ch: str) -> bool:
@@ -67,34 +142,68 @@ def is_newline(ch: str) -> bool:
 
 
 def is_whitespace(ch: str) -> bool:
-    return any([is_newline(ch), ch == "\u0009", ch == "\u0020"])
+    return bool(code_point_class(ch) & WHITESPACE)
 
 
 def is_surrogate(code_point: int) -> bool:
     return 0xD800 <= code_point <= 0xDFFF
 
 
+ESCAPE = r"\\(?:[0-9a-fA-F]{1,6}[ \t\n]?|[^\n]|\Z)"
+
+ESCAPE_RE = re.compile(r"\\(?:([0-9a-fA-F]{1,6})[ \t\n]?|(\n)|(.)|\Z)", re.DOTALL)
+
+
+# 4.3.7 for a whole span at once
+def decode_escape(m: re.Match) -> str:
+    digits, newline, ch = m.groups()
+    if digits is not None:
+        code_point = int(digits, 16)
+        if (
+            code_point > MAXIMUM_ALLOWED_CODE_POINT
+            or code_point == 0
+            or is_surrogate(code_point)
+        ):
+            return "\ufffd"
+        else:
+            return chr(code_point)
+    elif newline is not None:
+        return ""  # only reachable in a string, where it continues the line
+    elif ch is not None:
+        return ch
+    else:
+        # @@@ parse error
+        return "\ufffd"
+
+
+def decode_span(source: str, start: int, end: int) -> str:
+    raw = source[start:end]
+    if "\\" in raw:
+        return ESCAPE_RE.sub(decode_escape, raw)
+    else:
+        return raw
+
+
 # 4.3.8
 def are_a_valid_escape(ch_pair: str) -> bool:
-    return ch_pair[0] == "\\" and ch_pair[1] != "\n"
+    return ch_pair[0:1] == "\\" and ch_pair[1:2] != "\n"
 
 
 # 4.3.9
 def would_start_ident_sequence(ch_triplet: str) -> bool:
-    if ch_triplet[0] == "\u002d":
-        if any(
-            [
-                is_ident_start_code_point(ch_triplet[1]),
-                ch_triplet[1] == "\u002d",
-                are_a_valid_escape(ch_triplet[1:3]),
-            ]
+    first = ch_triplet[0:1]
+    if first == "\u002d":
+        if (
+            code_point_class(ch_triplet[1:2]) & IDENT_START
+            or ch_triplet[1:2] == "\u002d"
+            or are_a_valid_escape(ch_triplet[1:3])
         ):
             return True
         else:
             return False
-    elif is_ident_start_code_point(ch_triplet[0]):
+    elif code_point_class(first) & IDENT_START:
         return True
-    elif ch_triplet[0] == "\\":
+    elif ch_triplet[0:1] == "\\":
         if are_a_valid_escape(ch_triplet[0:2]):
             return True
         else:
@@ -105,19 +214,20 @@ def would_start_ident_sequence(ch_triplet: str) -> bool:
 
 # 4.3.10
 def start_number(ch_triplet: str) -> bool:
-    if ch_triplet[0] == "\u002b" or ch_triplet[0] == "\u002d":
-        if is_digit(ch_triplet[1]):
+    first = ch_triplet[0:1]
+    if first == "\u002b" or first == "\u002d":
+        if code_point_class(ch_triplet[1:2]) & DIGIT:
             return True
-        elif ch_triplet[1] == "." and is_digit(ch_triplet[2]):
+        elif ch_triplet[1:2] == "." and code_point_class(ch_triplet[2:3]) & DIGIT:
             return True
         else:
             return False
-    elif ch_triplet[0] == ".":
-        if is_digit(ch_triplet[1]):
+    elif first == ".":
+        if code_point_class(ch_triplet[1:2]) & DIGIT:
             return True
         else:
             return False
-    elif is_digit(ch_triplet[0]):
+    elif code_point_class(first) & DIGIT:
         return True
     else:
         return False
@@ -127,157 +237,212 @@ def start_number(ch_triplet: str) -> bool:
 def start_unicode_range(ch_triplet: str) -> bool:
     return all(
         [
-            ch_triplet[0] in ("U", "u"),
-            ch_triplet[1] == "+",
-            ch_triplet[2] == "\u003f" or is_hex_digit(ch_triplet[2]),
+            ch_triplet[0:1] in ("U", "u"),
+            ch_triplet[1:2] == "+",
+            ch_triplet[2:3] == "\u003f" or is_hex_digit(ch_triplet[2:3]),
         ]
     )
 
 
-MAXIMUM_ALLOWED_CODE_POINT = 0x10FFFF
-
-
 class Token:
-    pass
-
-
-class WhitespaceToken(Token):
+    __slots__ = ()
+
+
+# a token's position is the offset of its first code point, set by the
+# tokenizer as it yields the token; it is -1 for tokens made any other way
+# and for the shared valueless ones, and it's left out of == and repr
+def position_field():
+    return field(default=-1, repr=False, compare=False, kw_only=True)
+
+
+# the value of a span token is only sliced out of the source (and unescaped)
+# when it is first read; start and end are the value's span, which can be
+# inside the token (a string's quotes, an at-keyword's "@")
+class SpanToken(Token):
+    __slots__ = ("_value", "source", "start", "end", "position")
+
+    def __init__(self, value: str):
+        self._value = value
+        self.source = None
+        self.start = 0
+        self.end = 0
+        self.position = -1
+
+    @classmethod
+    def from_span(cls, source: str, start: int, end: int):
+        token = cls.__new__(cls)
+        token._value = None
+        token.source = source
+        token.start = start
+        token.end = end
+        token.position = -1
+        return token
+
+    @property
+    def value(self) -> str:
+        if self._value is None:
+            self._value = decode_span(self.source, self.start, self.end)
+            self.source = None
+        return self._value
+
+    def intern_value(self) -> None:
+        self._value = intern(self.value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.value == other.value
+
+    def __repr__(self):
+        return f"{type(self).__name__}(value={self.value!r})"
+
+
+# tokens without a value are shared, WhitespaceToken() is WhitespaceToken(),
+# so aren't at any one position
+class SingletonToken(Token):
+    __slots__ = ()
+    position = -1
+
+    def __new__(cls):
+        instance = cls.__dict__.get("instance")
+        if instance is None:
+            instance = super().__new__(cls)
+            cls.instance = instance
+        return instance
+
+
+class WhitespaceToken(SingletonToken):
     def __str__(self):
         return f"WS"
 
 
-class EofToken(Token):
+class EofToken(SingletonToken):
     def __str__(self):
         return f"EOF"
 
 
-class OpenCurlyToken(Token):
+class OpenCurlyToken(SingletonToken):
     def __str__(self):
         return f"OPEN-CURLY"
 
 
-class CloseCurlyToken(Token):
+class CloseCurlyToken(SingletonToken):
     def __str__(self):
         return f"CLOSE-CURLY"
 
 
-class ColonToken(Token):
+class ColonToken(SingletonToken):
     def __str__(self):
         return f"COLON"
 
 
-class SemicolonToken(Token):
+class SemicolonToken(SingletonToken):
     def __str__(self):
         return f"SEMICOLON"
 
 
-class OpenParen(Token):
+class OpenParen(SingletonToken):
     def __str__(self):
         return f"OPEN-PAREN"
 
 
-class CloseParen(Token):
+class CloseParen(SingletonToken):
     def __str__(self):
         return f"CLOSE-PAREN"
 
 
-class CommaToken(Token):
+class CommaToken(SingletonToken):
     def __str__(self):
         return f"COMMA"
 
 
-class OpenSquareToken(Token):
+class OpenSquareToken(SingletonToken):
     def __str__(self):
         return f"OPEN-SQUARE"
 
 
-class CloseSquareToken(Token):
+class CloseSquareToken(SingletonToken):
     def __str__(self):
         return f"CLOSE-SQUARE"
 
 
-class CdoToken(Token):
+class CdoToken(SingletonToken):
     def __str__(self):
         return f"CDO"
 
 
-class CdcToken(Token):
+class CdcToken(SingletonToken):
     def __str__(self):
         return f"CDC"
 
 
-@dataclass
-class IdentToken(Token):
-    value: str
+class IdentToken(SpanToken):
+    __slots__ = ()
 
     def __str__(self):
         return f"IDENT({self.value})"
 
 
-@dataclass
+@dataclass(slots=True)
 class DelimToken(Token):
     value: str
+    position: int = position_field()
 
     def __str__(self):
         return f"DELIM({self.value})"
 
 
-@dataclass
-class AtKeywordToken(Token):
-    value: str
+class AtKeywordToken(SpanToken):
+    __slots__ = ()
 
     def __str__(self):
         return f"AT({self.value})"
 
 
-@dataclass
-class StringToken(Token):
-    value: str
+class StringToken(SpanToken):
+    __slots__ = ()
 
     def __str__(self):
         return f"STRING({self.value})"
 
 
-class BadStringToken(Token):
+class BadStringToken(SingletonToken):
     def __str__(self):
         return f"@@@"
 
 
-@dataclass
-class FunctionToken(Token):
-    value: str
+class FunctionToken(SpanToken):
+    __slots__ = ()
 
     def __str__(self):
         return f"FUNCTION({self.value})"
 
 
-@dataclass
-class UrlToken(Token):
-    value: str
+class UrlToken(SpanToken):
+    __slots__ = ()
 
     def __str__(self):
         return f"URL({self.value})"
 
 
-@dataclass
-class BadUrlToken(Token):
+class BadUrlToken(SingletonToken):
     def __str__(self):
         return f"@@@"
 
 
-@dataclass
+@dataclass(slots=True)
 class HashToken(Token):
     value: str
     type_flag: Literal["id", "unrestricted"]
+    position: int = position_field()
 
     def __str__(self):
         return f"HASH({self.value})"
 
 
-@dataclass
+@dataclass(slots=True)
 class PercentageToken(Token):
     value: float
     sign_character: Literal["", "+", "-"]
+    position: int = position_field()
 
     def __str__(self):
         sign_str = self.sign_character if self.sign_character == "+" else ""
@@ -285,11 +450,12 @@ class PercentageToken(Token):
 
 
 # @@@ could split this into separate integer/number classes
-@dataclass
+@dataclass(slots=True)
 class NumberToken(Token):
     value: int | float
     type_flag: Literal["integer", "number"]
     sign_character: Literal["", "+", "-"]
+    position: int = position_field()
 
     def __str__(self):
         sign_str = self.sign_character if self.sign_character == "+" else ""
@@ -300,22 +466,24 @@ class NumberToken(Token):
 
 
 # @@@ could split this into separate integer/number classes
-@dataclass
+@dataclass(slots=True)
 class DimensionToken(Token):
     value: int | float
     type_flag: Literal["integer", "number"]
     sign_character: Literal["", "+", "-"]
     unit: str
+    position: int = position_field()
 
     def __str__(self):
         sign_str = self.sign_character if self.sign_character == "+" else ""
         return f"DIM({sign_str}{self.value}, {self.unit})"
 
 
-@dataclass
+@dataclass(slots=True)
 class UnicodeRangeToken(Token):
     start: int
     end: int
+    position: int = position_field()
 
     def __str__(self):
         if self.start == self.end:
@@ -324,16 +492,314 @@ class UnicodeRangeToken(Token):
             return f"UNICODE-RANGE({hex(self.start)}-{hex(self.end)})"
 
 
+# a token's type as a small integer, for TokenBuffer
+TOKEN_TYPES = [
+    EofToken,
+    WhitespaceToken,
+    IdentToken,
+    FunctionToken,
+    AtKeywordToken,
+    HashToken,
+    StringToken,
+    BadStringToken,
+    UrlToken,
+    BadUrlToken,
+    DelimToken,
+    NumberToken,
+    PercentageToken,
+    DimensionToken,
+    UnicodeRangeToken,
+    CdoToken,
+    CdcToken,
+    ColonToken,
+    SemicolonToken,
+    CommaToken,
+    OpenSquareToken,
+    CloseSquareToken,
+    OpenParen,
+    CloseParen,
+    OpenCurlyToken,
+    CloseCurlyToken,
+]
+TOKEN_TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+
+
+# what makes two tokens the same, as a hashable key: tokens of a singleton
+# type by their type, span tokens by their string, and the rest by their
+# repr, which unlike == tells 50% from 50.0% and 0 from -0.0
+def token_key(token: Token):
+    if isinstance(token, SingletonToken):
+        return type(token)
+    elif isinstance(token, SpanToken):
+        return (type(token), token.value)
+    return repr(token)
+
+
+# patterns for the fast path: each only covers the escape-free common case
+# of its token, anything else is left to the spec-following consume_a_token
+
+IDENT_START_CHARS = "a-zA-Z_" + "".join(
+    f"{chr(first)}-{chr(last)}" for first, last in NON_ASCII_IDENT_RANGES
+)
+IDENT_CHARS = IDENT_START_CHARS + "0-9\\-"
+IDENT_PATTERN = f"(?:--|-?[{IDENT_START_CHARS}])[{IDENT_CHARS}]*"
+
+FAST_TOKEN_RE = re.compile(
+    rf"""
+    (?P<whitespace>[ \t\n]+)
+    | (?P<number>[+-]?(?:[0-9]+(?:\.[0-9]+)?|\.[0-9]+))(?:[eE](?P<exponent>[+-]?[0-9]+))?
+      (?:(?P<unit>{IDENT_PATTERN})|(?P<percent>%))?
+    | [uU][rR][lL]\([ \t\n]*
+      (?P<url>[^"'()\\ \t\n\x00-\x08\x0b\x0e-\x1f\x7f]*)[ \t\n]*\)
+    | (?P<cdc>-->)
+    | (?P<ident>{IDENT_PATTERN})(?P<function>\()?
+    | @(?P<at>{IDENT_PATTERN})
+    | \#(?P<hash>[{IDENT_CHARS}]+)
+    | "(?P<dq_string>[^"\\\n]*)"
+    | '(?P<sq_string>[^'\\\n]*)'
+    """,
+    re.VERBOSE,
+)
+
+SIMPLE_TOKENS = {
+    ":": ColonToken(),
+    ";": SemicolonToken(),
+    ",": CommaToken(),
+    "{": OpenCurlyToken(),
+    "}": CloseCurlyToken(),
+    "(": OpenParen(),
+    ")": CloseParen(),
+    "[": OpenSquareToken(),
+    "]": CloseSquareToken(),
+}
+
+# the spec path scans whole runs with these rather than code point by
+# code point; escapes are only decoded when the value is read
+
+IDENT_SEQUENCE_RE = re.compile(f"[{IDENT_CHARS}]*(?:{ESCAPE}[{IDENT_CHARS}]*)*")
+
+STRING_RES = {
+    quote: re.compile(
+        rf"[^{quote}\\\n]*(?:\\(?:[0-9a-fA-F]{{1,6}}[ \t\n]?|.|\Z)[^{quote}\\\n]*)*",
+        re.DOTALL,
+    )
+    for quote in "\"'"
+}
+
+URL_CHARS = r"""[^"'()\\ \t\n\x00-\x08\x0b\x0e-\x1f\x7f]"""
+URL_RE = re.compile(f"{URL_CHARS}*(?:{ESCAPE}{URL_CHARS}*)*")
+
+# code points that can only be a delim once the regex has not matched
+FAST_DELIMS = ".+>*~!|=$^&?%"
+
+# 4.3.13, only matched where a number starts; groups for the fractional part
+# and exponent, so an integer matches no group at all
+NUMBER_RE = re.compile(r"[+-]?[0-9]*(\.[0-9]+)?([eE][+-]?[0-9]+)?")
+
+WHITESPACE_RUN_RE = re.compile("[ \t\n]*")
+
+NAME_TOKEN_TYPES = (IdentToken, FunctionToken, AtKeywordToken)
+
+# whitespace next to these (or at the start or end of the input) changes
+# nothing, so the compact mode leaves it out
+COMPACT_NEIGHBOURS = (OpenCurlyToken, CloseCurlyToken, SemicolonToken, CommaToken, EofToken)
+
+# no token looks further than this past its own end
+STREAM_LOOKAHEAD = 8
+
+
+# leaves out whitespace tokens at the start and end of the input, next to one
+# of COMPACT_NEIGHBOURS, and all but one of several in a row (as separated
+# by comments)
+def compact_whitespace(tokens: Iterable[Token]) -> Generator[Token]:
+    whitespace = WhitespaceToken()
+    pending = False
+    after_neighbour = True
+    for token in tokens:
+        if token is whitespace:
+            pending = not after_neighbour
+            continue
+        if pending and not isinstance(token, COMPACT_NEIGHBOURS):
+            yield whitespace
+        pending = False
+        after_neighbour = isinstance(token, COMPACT_NEIGHBOURS)
+        yield token
+
+
+# gives ident, function and at-keyword tokens the one shared str object for
+# their value, the same one as in css3syntax.names for known names, so names
+# can be compared by identity
+def intern_names(tokens: Iterable[Token]) -> Generator[Token]:
+    for token in tokens:
+        if type(token) in NAME_TOKEN_TYPES:
+            token.intern_value()
+        yield token
+
+
 class Tokenizer:
-    def __init__(self, unicode_ranges_allowed=False):
+    def __init__(
+        self, unicode_ranges_allowed=False, fast=False, compact=False, intern_names=False
+    ):
         self.unicode_ranges_allowed = unicode_ranges_allowed
+        self.fast = fast
+        self.compact = compact
+        self.intern_names = intern_names
 
     def tokenize(self, s: str) -> Generator[Token]:
+        tokens = self.consume_tokens(s)
+        if self.intern_names:
+            tokens = intern_names(tokens)
+        return compact_whitespace(tokens) if self.compact else tokens
+
+    def consume_tokens(self, s: str) -> Generator[Token]:
+        self.s = s
+        self.index = 0
+
+        if self.fast:
+            consume_a_token = self.consume_a_token_fast
+        else:
+            consume_a_token = self.consume_a_token
+        consume_comments = self.consume_comments
+        unicode_ranges_allowed = self.unicode_ranges_allowed
+
+        while True:
+            consume_comments()
+            position = self.index
+            token = consume_a_token(unicode_ranges_allowed)
+            if not isinstance(token, SingletonToken):
+                token.position = position
+            yield token
+            if isinstance(token, EofToken):
+                break
+
+    def tokenize_to_buffer(self, s: str) -> "TokenBuffer":
+        buffer = TokenBuffer(s, self)
+        self.s = s
+        self.index = 0
+        self.fill_buffer(buffer)
+        return buffer
+
+    # re-lexes after replacing deleted code points at offset with inserted,
+    # starting at the end of the last token whose lookahead can't have
+    # reached the edit; once a new token starts where an old one started
+    # (moved by the edit) the rest of the input, so of the tokens, is the same
+    def retokenize(
+        self, buffer: "TokenBuffer", offset: int, deleted: int, inserted: str
+    ) -> "TokenBuffer":
+        source = buffer.source
+        s = source[:offset] + inserted + source[offset + deleted :]
+        delta = len(inserted) - deleted
+        kept = bisect_right(buffer.ends, offset - STREAM_LOOKAHEAD)
+
+        new_buffer = TokenBuffer(s, self)
+        new_buffer.types = buffer.types[:kept]
+        new_buffer.starts = buffer.starts[:kept]
+        new_buffer.ends = buffer.ends[:kept]
+        new_buffer.numbers = buffer.numbers[:kept]
+
         self.s = s
+        self.index = buffer.ends[kept - 1] if kept else 0
+        resync = self.fill_buffer(new_buffer, buffer, offset + len(inserted), delta)
+
+        new_buffer.types.extend(buffer.types[resync:])
+        new_buffer.starts.extend(map(delta.__add__, buffer.starts[resync:]))
+        new_buffer.ends.extend(map(delta.__add__, buffer.ends[resync:]))
+        new_buffer.numbers.extend(buffer.numbers[resync:])
+        return new_buffer
+
+    # appends tokens from self.index up to EOF or, given an old buffer, up to
+    # the first old token starting at or after edit_end, which is returned
+    def fill_buffer(
+        self,
+        buffer: "TokenBuffer",
+        old_buffer: "TokenBuffer | None" = None,
+        edit_end: int = 0,
+        delta: int = 0,
+    ) -> int:
+        types = buffer.types
+        starts = buffer.starts
+        ends = buffer.ends
+        numbers = buffer.numbers
+
+        if self.fast:
+            consume_a_token = self.consume_a_token_fast
+        else:
+            consume_a_token = self.consume_a_token
+
+        while True:
+            self.consume_comments()
+            start = self.index
+            if old_buffer is not None and start >= edit_end:
+                old_starts = old_buffer.starts
+                i = bisect_left(old_starts, start - delta)
+                if i < len(old_starts) and old_starts[i] == start - delta:
+                    return i
+            token = consume_a_token(self.unicode_ranges_allowed)
+            types.append(TOKEN_TYPE_CODES[type(token)])
+            starts.append(start)
+            ends.append(self.index)
+            if isinstance(token, (NumberToken, PercentageToken, DimensionToken)):
+                numbers.append(token.value)
+            else:
+                numbers.append(0.0)
+            if isinstance(token, EofToken):
+                return len(old_buffer) if old_buffer is not None else len(types)
+
+    # tokenizes a text or binary file object while only holding a window of
+    # it in self.s: a token that runs into the end of the window is thrown
+    # away and consumed again once more input has been read
+    def tokenize_stream(
+        self, f: IO, chunk_size: int = 65536, encoding: str = "utf-8"
+    ) -> Generator[Token]:
+        tokens = self.consume_stream_tokens(f, chunk_size, encoding)
+        if self.intern_names:
+            tokens = intern_names(tokens)
+        return compact_whitespace(tokens) if self.compact else tokens
+
+    def consume_stream_tokens(
+        self, f: IO, chunk_size: int, encoding: str
+    ) -> Generator[Token]:
+        self.s = ""
         self.index = 0
 
+        if self.fast:
+            consume_a_token = self.consume_a_token_fast
+        else:
+            consume_a_token = self.consume_a_token
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        at_end = False
+        offset = 0  # of self.s in the whole input
+
         while True:
-            token = self.consume_a_token(self.unicode_ranges_allowed)
+            start = self.index
+            self.consume_comments()
+            position = self.index
+            token = consume_a_token(self.unicode_ranges_allowed)
+
+            if not at_end and self.index + STREAM_LOOKAHEAD > len(self.s):
+                # drop what has been consumed and at least double what is
+                # left, so a long token is only consumed again O(log n) times
+                wanted = 2 * (len(self.s) - start) + chunk_size
+                self.s = self.s[start:]
+                self.index = 0
+                offset += start
+                while not at_end and len(self.s) < wanted:
+                    data = f.read(chunk_size)
+                    if not data:
+                        at_end = True
+                    if isinstance(data, bytes):
+                        data = decoder.decode(data, final=at_end)
+                    self.s += data
+                continue
+
+            if isinstance(token, SpanToken):
+                # materialize now rather than keep the window alive
+                token.value
+                token.start += offset
+                token.end += offset
+            if not isinstance(token, SingletonToken):
+                token.position = position + offset
             yield token
             if isinstance(token, EofToken):
                 break
@@ -348,8 +814,7 @@ class Tokenizer:
         return ch
 
     def consume_whitespace(self) -> None:
-        while self.index < len(self.s) and is_whitespace(self.s[self.index]):
-            self.index += 1
+        self.index = WHITESPACE_RUN_RE.match(self.s, self.index).end()
 
     def next_input_code_point(self, size=1) -> str:
         return self.s[self.index : self.index + size]
@@ -366,7 +831,9 @@ class Tokenizer:
         if ch is None:
             return EofToken()
 
-        elif is_whitespace(ch):
+        char_class = code_point_class(ch)
+
+        if char_class & WHITESPACE:
             self.consume_whitespace()
             return WhitespaceToken()
 
@@ -377,18 +844,13 @@ class Tokenizer:
             if is_ident_code_point(self.next_input_code_point()) or are_a_valid_escape(
                 self.next_input_code_point(2)
             ):
-                return HashToken(
-                    self.consume_an_ident_sequence(),
-                    type_flag="id"
-                    if would_start_ident_sequence(self.next_input_code_point(3))
-                    else "unrestricted",
-                )
-            else:
-                value = self.consume_next_input_code_point()
-                if value is not None:
-                    return DelimToken(value)
+                if would_start_ident_sequence(self.next_input_code_point(3)):
+                    type_flag = "id"
                 else:
-                    return EofToken()  # is this case described in spec?
+                    type_flag = "unrestricted"
+                return HashToken(self.consume_an_ident_sequence(), type_flag=type_flag)
+            else:
+                return DelimToken(ch)
 
         elif ch == "'":
             return self.consume_a_string_token("'")
@@ -400,7 +862,7 @@ class Tokenizer:
             return CloseParen()
 
         elif ch == "+":
-            if start_number(self.next_input_code_point(3)):
+            if start_number(ch + self.next_input_code_point(2)):
                 self.reconsume_input_code_point()
                 return self.consume_a_numeric_token()
             else:
@@ -410,20 +872,20 @@ class Tokenizer:
             return CommaToken()
 
         elif ch == "-":
-            if start_number(self.next_input_code_point(3)):
+            if start_number(ch + self.next_input_code_point(2)):
                 self.reconsume_input_code_point()
                 return self.consume_a_numeric_token()
             elif self.next_input_code_point(2) == "->":
                 self.index += 2
                 return CdcToken()
-            elif would_start_ident_sequence(self.next_input_code_point(3)):
+            elif would_start_ident_sequence(ch + self.next_input_code_point(2)):
                 self.reconsume_input_code_point()
                 return self.consume_an_ident_like_token()
             else:
                 return DelimToken(ch)
 
         elif ch == ".":
-            if start_number(self.next_input_code_point(3)):
+            if start_number(ch + self.next_input_code_point(2)):
                 self.reconsume_input_code_point()
                 return self.consume_a_numeric_token()
             else:
@@ -444,7 +906,9 @@ class Tokenizer:
 
         elif ch == "@":
             if would_start_ident_sequence(self.next_input_code_point(3)):
-                return AtKeywordToken(self.consume_an_ident_sequence())
+                start = self.index
+                self.consume_an_ident_sequence_span()
+                return AtKeywordToken.from_span(self.s, start, self.index)
             else:
                 return DelimToken(ch)
 
@@ -452,7 +916,7 @@ class Tokenizer:
             return OpenSquareToken()
 
         elif ch == "\\":
-            if are_a_valid_escape(self.next_input_code_point(2)):
+            if are_a_valid_escape(ch + self.next_input_code_point()):
                 self.reconsume_input_code_point()
                 return self.consume_an_ident_like_token()
             else:
@@ -468,13 +932,13 @@ class Tokenizer:
         elif ch == "}":
             return CloseCurlyToken()
 
-        elif is_digit(ch):
+        elif char_class & DIGIT:
             self.reconsume_input_code_point()
             return self.consume_a_numeric_token()
 
         elif ch == "U" or ch == "u":
             if unicode_ranges_allowed and start_unicode_range(
-                self.next_input_code_point(3)
+                ch + self.next_input_code_point(2)
             ):
                 self.reconsume_input_code_point()
                 return self.consume_a_unicode_range_token()
@@ -482,29 +946,110 @@ class Tokenizer:
                 self.reconsume_input_code_point()
                 return self.consume_an_ident_like_token()
 
-        elif is_ident_start_code_point(ch):
+        elif char_class & IDENT_START:
             self.reconsume_input_code_point()
             return self.consume_an_ident_like_token()
 
         else:
             return DelimToken(ch)
 
+    # same tokens as consume_a_token, but the common cases are matched with
+    # a single regex rather than one code point at a time
+    def consume_a_token_fast(self, unicode_ranges_allowed: bool = False) -> Token:
+        s = self.s
+        start = self.index
+
+        if start >= len(s):
+            return EofToken()
+
+        token = SIMPLE_TOKENS.get(s[start])
+        if token is not None:
+            self.index = start + 1
+            return token
+
+        m = FAST_TOKEN_RE.match(s, start)
+        if m is None:
+            ch = s[start]
+            if ch in FAST_DELIMS or (ch == "/" and not s.startswith("*", start + 1)):
+                self.index = start + 1
+                return DelimToken(ch)
+            return self.consume_a_token(unicode_ranges_allowed)
+
+        end = m.end()
+        kind = m.lastgroup
+
+        if kind == "whitespace":
+            token = WhitespaceToken()
+        elif kind in ("number", "exponent", "unit", "percent"):
+            # a following escape or "-" escape would continue the unit
+            if s.startswith("\\", end) or (
+                kind in ("number", "exponent") and s.startswith("-\\", end)
+            ):
+                return self.consume_a_token(unicode_ranges_allowed)
+            number = m.group("number")
+            exponent = m.group("exponent")
+            sign_character = number[0] if number[0] in "+-" else ""
+            if exponent is not None:
+                type_flag, value = "number", float(s[start : m.end("exponent")])
+            elif "." in number:
+                type_flag, value = "number", float(number)
+            else:
+                type_flag, value = "integer", int(number)
+            if kind == "unit":
+                token = DimensionToken(value, type_flag, sign_character, m.group("unit"))
+            elif kind == "percent":
+                token = PercentageToken(value, sign_character)
+            else:
+                token = NumberToken(value, type_flag, sign_character)
+        elif kind == "url":
+            token = UrlToken.from_span(s, m.start("url"), m.end("url"))
+        elif kind == "cdc":
+            token = CdcToken()
+        elif kind in ("ident", "function"):
+            ident_end = m.end("ident")
+            if s.startswith("\\", ident_end):
+                return self.consume_a_token(unicode_ranges_allowed)
+            elif kind == "function":
+                if s[start:ident_end].lower() == "url":
+                    return self.consume_a_token(unicode_ranges_allowed)
+                token = FunctionToken.from_span(s, start, ident_end)
+            elif (
+                unicode_ranges_allowed
+                and s[start:end] in ("U", "u")
+                and s.startswith("+", end)
+            ):
+                return self.consume_a_token(unicode_ranges_allowed)
+            else:
+                token = IdentToken.from_span(s, start, end)
+        elif kind == "at":
+            if s.startswith("\\", end):
+                return self.consume_a_token(unicode_ranges_allowed)
+            token = AtKeywordToken.from_span(s, start + 1, end)
+        elif kind == "hash":
+            if s.startswith("\\", end):
+                return self.consume_a_token(unicode_ranges_allowed)
+            value = m.group("hash")
+            if would_start_ident_sequence(value[:3]):
+                type_flag = "id"
+            else:
+                type_flag = "unrestricted"
+            token = HashToken(value, type_flag)
+        else:  # dq_string or sq_string
+            token = StringToken.from_span(s, start + 1, end - 1)
+
+        self.index = end
+        return token
+
     # 4.3.2
     def consume_comments(self) -> None:
-        while True:
-            if self.next_input_code_point(2) == "/*":
-                self.index += 2
-                while True:
-                    if self.next_input_code_point(2) == "*/":
-                        self.index += 2
-                        break
-                    elif self.index >= len(self.s):
-                        # @@@ parse error
-                        break
-                    else:
-                        self.index += 1
+        s = self.s
+        while s.startswith("/*", self.index):
+            end = s.find("*/", self.index + 2)
+            if end == -1:
+                # @@@ parse error
+                self.index = len(s)
             else:
-                break
+                self.index = end + 2
 
     # 4.3.3
     def consume_a_numeric_token(self) -> NumberToken | PercentageToken | DimensionToken:
@@ -522,12 +1067,16 @@ class Tokenizer:
     def consume_an_ident_like_token(
         self,
     ) -> IdentToken | FunctionToken | UrlToken | BadUrlToken | EofToken:
-        string = self.consume_an_ident_sequence()
-        if string.lower() == "url" and self.next_input_code_point() == "(":
+        start = self.index
+        self.consume_an_ident_sequence_span()
+        end = self.index
+        if self.next_input_code_point() != "(":
+            return IdentToken.from_span(self.s, start, end)
+        if decode_span(self.s, start, end).lower() == "url":
             self.index += 1
             while True:
                 next_two = self.next_input_code_point(2)
-                if is_whitespace(next_two[0]) and is_whitespace(next_two[1]):
+                if is_whitespace(next_two[0:1]) and is_whitespace(next_two[1:2]):
                     self.index += 1
                     continue
                 else:
@@ -537,84 +1086,64 @@ class Tokenizer:
                     self.next_input_code_point() == '"',
                     self.next_input_code_point() == "'",
                     is_whitespace(self.next_input_code_point())
-                    and self.next_input_code_point(2)[1] == '"',
+                    and self.next_input_code_point(2)[1:2] == '"',
                     is_whitespace(self.next_input_code_point())
-                    and self.next_input_code_point(2)[1] == "'",
+                    and self.next_input_code_point(2)[1:2] == "'",
                 ]
             ):
-                return FunctionToken(string)
+                return FunctionToken.from_span(self.s, start, end)
             else:
                 return self.consume_a_url_token()
-        elif self.next_input_code_point() == "(":
-            self.index += 1
-            return FunctionToken(string)
         else:
-            return IdentToken(string)
+            self.index += 1
+            return FunctionToken.from_span(self.s, start, end)
 
     # 4.3.5
     def consume_a_string_token(
         self, ending_code_point
     ) -> StringToken | BadStringToken | EofToken:
-        string = ""
-        while True:
-            ch = self.consume_next_input_code_point()
-            if ch == ending_code_point:
-                return StringToken(string)
-            elif ch is None:
-                # @@@ parse error
-                return EofToken()
-            elif is_newline(ch):
-                # @@@ parse error
-                self.reconsume_input_code_point()
-                return BadStringToken()
-            elif ch == "\\":
-                if self.index >= len(self.s):
-                    continue
-                elif is_newline(self.next_input_code_point()):
-                    self.index += 1
-                else:
-                    string += self.consume_an_escaped_code_point()
-            else:
-                string += ch
+        start = self.index
+        self.index = STRING_RES[ending_code_point].match(self.s, start).end()
+        end = self.index
+        ch = self.consume_next_input_code_point()
+        if ch == ending_code_point:
+            return StringToken.from_span(self.s, start, end)
+        elif ch is None:
+            # @@@ parse error
+            return EofToken()
+        else:  # newline
+            # @@@ parse error
+            self.reconsume_input_code_point()
+            return BadStringToken()
 
     # 4.3.6
     def consume_a_url_token(self) -> UrlToken | BadUrlToken | EofToken:
-        string = ""
         self.consume_whitespace()
-        while True:
-            ch = self.consume_next_input_code_point()
-            if ch == ")":
-                return UrlToken(string)
-            elif ch is None:
+        start = self.index
+        self.index = URL_RE.match(self.s, start).end()
+        end = self.index
+        ch = self.consume_next_input_code_point()
+        if ch == ")":
+            return UrlToken.from_span(self.s, start, end)
+        elif ch is None:
+            # @@@ parse error
+            return EofToken()
+        elif is_whitespace(ch):
+            self.consume_whitespace()
+            if self.next_input_code_point() == ")":
+                self.index += 1
+                return UrlToken.from_span(self.s, start, end)
+            elif self.index >= len(self.s):
                 # @@@ parse error
-                return EofToken()
-            elif is_whitespace(ch):
-                self.consume_whitespace()
-                if self.next_input_code_point() == ")":
-                    self.index += 1
-                    return UrlToken(string)
-                elif self.index >= len(self.s):
-                    # @@@ parse error
-                    return UrlToken(string)
-                else:
-                    # @@@ parse error
-                    self.consume_remnant_of_a_bad_url()
-                    return BadUrlToken()
-            elif any(
-                [ch == '"', ch == "'", ch == "(", is_non_printable_code_point(ch)]
-            ):
+                return UrlToken.from_span(self.s, start, end)
+            else:
                 # @@@ parse error
                 self.consume_remnant_of_a_bad_url()
                 return BadUrlToken()
-            elif ch == "\\":
-                if are_a_valid_escape(self.next_input_code_point(2)):
-                    string += self.consume_an_escaped_code_point()
-                else:
-                    # @@@ parse error
-                    self.consume_remnant_of_a_bad_url()
-                    return BadUrlToken()
-            else:
-                string += ch
+        else:  # quote, open paren, non-printable or invalid escape
+            # @@@ parse error
+            self.consume_remnant_of_a_bad_url()
+            return BadUrlToken()
 
     # 4.3.7
     def consume_an_escaped_code_point(self) -> str:
@@ -635,6 +1164,9 @@ class Tokenizer:
                 else:
                     self.reconsume_input_code_point()
                     break
+            else:
+                if is_whitespace(self.next_input_code_point()):
+                    self.index += 1
             code_point = int(digits, 16)
             if (
                 code_point > MAXIMUM_ALLOWED_CODE_POINT
@@ -649,81 +1181,24 @@ class Tokenizer:
 
     # 4.3.12
     def consume_an_ident_sequence(self) -> str:
-        result = ""
-        while True:
-            ch = self.consume_next_input_code_point()
-            if ch is None:  # is this case described in spec?
-                break
-            if is_ident_code_point(ch):
-                result += ch
-            elif are_a_valid_escape(self.next_input_code_point(2)):
-                result += self.consume_an_escaped_code_point()
-            else:
-                self.reconsume_input_code_point()
-                break
-        return result
+        start = self.index
+        self.consume_an_ident_sequence_span()
+        return decode_span(self.s, start, self.index)
+
+    def consume_an_ident_sequence_span(self) -> None:
+        self.index = IDENT_SEQUENCE_RE.match(self.s, self.index).end()
 
     # 4.3.13
     def consume_a_number(self) -> tuple:
-        _type = "integer"
-        number_part = ""
-        exponent_part = ""
-        sign_character = ""
-        tmp = self.next_input_code_point()
-        if tmp == "+" or tmp == "-":
-            sign_character = tmp
-            number_part += sign_character
-            self.index += 1
-        while True:
-            tmp = self.next_input_code_point()
-            if is_digit(tmp):
-                number_part += tmp
-                self.index += 1
-            else:
-                break
-        if self.next_input_code_point() == "." and is_digit(
-            self.next_input_code_point(2)[1]
-        ):
-            _type = "number"
-            number_part += "."
-            self.index += 1
-            while True:
-                tmp = self.next_input_code_point()
-                if is_digit(tmp):
-                    number_part += tmp
-                    self.index += 1
-                else:
-                    break
-        if any(
-            [
-                self.next_input_code_point() in ("E", "e")
-                and is_digit(self.next_input_code_point(2)[1]),
-                self.next_input_code_point(2) in ("E+", "E-", "e+", "e-")
-                and is_digit(self.next_input_code_point(3)[2]),
-            ]
-        ):
-            self.consume_next_input_code_point()  # E or e
-            tmp = self.next_input_code_point()
-            if tmp == "+" or tmp == "-":
-                exponent_part += tmp
-                self.index += 1
-            while True:
-                tmp = self.next_input_code_point()
-                if is_digit(tmp):
-                    exponent_part += tmp
-                    self.index += 1
-                else:
-                    break
-            _type = "number"
-        if exponent_part:
-            value = float(number_part) * (10 ** int(exponent_part))
+        m = NUMBER_RE.match(self.s, self.index)
+        self.index = m.end()
+        number = m.group()
+        sign_character = number[0] if number[0] in "+-" else ""
+        if m.lastindex is None:
+            return (int(number), "integer", sign_character)
         else:
-            if _type == "integer":
-                value = int(number_part)
-            else:
-                value = float(number_part)
-
-        return (value, _type, sign_character)
+            # the whole representation in one go, rounded once
+            return (float(number), "number", sign_character)
 
     # 4.3.14
     # "due to a bad syntax design in early CSS"
@@ -757,7 +1232,7 @@ class Tokenizer:
             return UnicodeRangeToken(start_of_range, end_of_range)
         start_of_range = int(first_segment, 16)
         if self.next_input_code_point() == "-" and is_hex_digit(
-            self.next_input_code_point(2)[1]
+            self.next_input_code_point(2)[1:2]
         ):
             self.index += 1
             second_segment = ""
@@ -783,7 +1258,69 @@ class Tokenizer:
             ch = self.consume_next_input_code_point()
             if ch is None or ch == ")":
                 return
-            elif are_a_valid_escape(self.next_input_code_point(2)):
+            elif are_a_valid_escape(ch + self.next_input_code_point()):
                 self.consume_an_escaped_code_point()
             else:
                 continue
+
+
+NEWLINE_RE = re.compile("\n")
+
+
+# turns offsets into a source, such as a token's position, into a line and
+# column (both from 1); tokens only carry offsets, and the newlines are only found on the first lookup
+class LineIndex:
+    def __init__(self, source: str):
+        self.source = source
+        self.line_starts = None
+
+    def line_column(self, offset: int) -> tuple[int, int]:
+        line_starts = self.line_starts
+        if line_starts is None:
+            line_starts = array("I", [0])
+            line_starts.extend(m.end() for m in NEWLINE_RE.finditer(self.source))
+            self.line_starts = line_starts
+        line = bisect_right(line_starts, offset)
+        return line, offset - line_starts[line - 1] + 1
+
+
+# a whole tokenized stylesheet as parallel arrays of type code, start and end
+# offset and numeric value; Token objects are only built again, by consuming
+# the token at its start offset, when the buffer is indexed
+class TokenBuffer:
+    def __init__(self, source: str, tokenizer: Tokenizer):
+        self.source = source
+        self.tokenizer = Tokenizer(tokenizer.unicode_ranges_allowed, tokenizer.fast)
+        self.types = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.numbers = array("d")
+        self.lines = LineIndex(source)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, i: int) -> Token:
+        tokenizer = self.tokenizer
+        tokenizer.s = self.source
+        tokenizer.index = self.starts[i]
+        if tokenizer.fast:
+            token = tokenizer.consume_a_token_fast(tokenizer.unicode_ranges_allowed)
+        else:
+            token = tokenizer.consume_a_token(tokenizer.unicode_ranges_allowed)
+        if not isinstance(token, SingletonToken):
+            token.position = self.starts[i]
+        return token
+
+    def __iter__(self) -> Generator[Token]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def type_of(self, i: int) -> type:
+        return TOKEN_TYPES[self.types[i]]
+
+    def text_of(self, i: int) -> str:
+        return self.source[self.starts[i] : self.ends[i]]
+
+    def line_column_of(self, i: int) -> tuple[int, int]:
+        return self.lines.line_column(self.starts[i])
@@ -0,0 +1,339 @@
+from dataclasses import dataclass
+from string import hexdigits
+
+from .parser import Declaration, Function, SimpleBlock
+from .tokenizer import (
+    DimensionToken,
+    HashToken,
+    IdentToken,
+    NumberToken,
+    PercentageToken,
+    Token,
+    WhitespaceToken,
+    token_key,
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Length:
+    value: int | float
+    unit: str
+
+
+@dataclass(frozen=True, slots=True)
+class Percentage:
+    value: int | float
+
+
+@dataclass(frozen=True, slots=True)
+class Number:
+    value: int | float
+
+
+# rgba is packed as 0xRRGGBBAA
+@dataclass(frozen=True, slots=True)
+class Color:
+    rgba: int
+
+
+@dataclass(frozen=True, slots=True)
+class Keyword:
+    name: str
+
+
+LENGTH_UNITS = frozenset(
+    ["px", "em", "rem", "ex", "ch", "vw", "vh", "vmin", "vmax", "cm", "mm", "q", "in", "pt", "pc"]
+)
+
+NAMED_COLORS = {
+    "black": 0x000000FF,
+    "silver": 0xC0C0C0FF,
+    "gray": 0x808080FF,
+    "grey": 0x808080FF,
+    "white": 0xFFFFFFFF,
+    "maroon": 0x800000FF,
+    "red": 0xFF0000FF,
+    "purple": 0x800080FF,
+    "fuchsia": 0xFF00FFFF,
+    "green": 0x008000FF,
+    "lime": 0x00FF00FF,
+    "olive": 0x808000FF,
+    "yellow": 0xFFFF00FF,
+    "navy": 0x000080FF,
+    "blue": 0x0000FFFF,
+    "teal": 0x008080FF,
+    "aqua": 0x00FFFFFF,
+    "orange": 0xFFA500FF,
+    "transparent": 0x00000000,
+}
+
+CSS_WIDE_KEYWORDS = frozenset(["inherit", "initial", "unset"])
+
+# a hashable stand-in for a value's tokens (tokens themselves aren't
+# hashable); whitespace never matters to the grammars below, so it's left out
+def value_key(items) -> tuple:
+    return tuple([item_key(item) for item in items if not isinstance(item, WhitespaceToken)])
+
+
+def item_key(item):
+    cls = type(item)
+    if isinstance(item, Token):
+        return token_key(item)
+    elif cls is Function:
+        return (cls, item.name.lower(), tuple(map(value_key, item.arguments)))
+    elif cls is SimpleBlock:
+        return (cls, type(item.associated_token), value_key(item.value))
+    else:
+        return cls
+
+
+# component value parsers: each takes one token or node and returns its
+# typed value, or None if it isn't one
+
+
+def length(item):
+    if isinstance(item, DimensionToken) and item.unit.lower() in LENGTH_UNITS:
+        return Length(item.value, item.unit.lower())
+    elif isinstance(item, NumberToken) and item.value == 0:
+        return Length(0, "px")
+    return None
+
+
+def percentage(item):
+    if isinstance(item, PercentageToken):
+        return Percentage(item.value)
+    return None
+
+
+def number(item):
+    if isinstance(item, NumberToken):
+        return Number(item.value)
+    return None
+
+
+def integer(item):
+    if isinstance(item, NumberToken) and item.type_flag == "integer":
+        return Number(item.value)
+    return None
+
+
+def non_negative(parser):
+    def parse(item):
+        value = parser(item)
+        return value if value is not None and value.value >= 0 else None
+
+    return parse
+
+
+def color_channel(items, scale: int):
+    if len(items) != 1:
+        return None
+    [item] = items
+    if isinstance(item, NumberToken):
+        value = item.value * scale
+    elif isinstance(item, PercentageToken):
+        value = item.value * 255 / 100
+    else:
+        return None
+    return min(255, max(0, round(value)))
+
+
+def color(item):
+    if isinstance(item, HashToken):
+        digits = item.value
+        if len(digits) in (3, 4):
+            digits = "".join(digit * 2 for digit in digits)
+        if len(digits) == 6:
+            digits += "ff"
+        # int() would also take a sign, underscores and spaces
+        if len(digits) != 8 or not all(digit in hexdigits for digit in digits):
+            return None
+        return Color(int(digits, 16))
+    elif isinstance(item, IdentToken):
+        rgba = NAMED_COLORS.get(item.value.lower())
+        return None if rgba is None else Color(rgba)
+    elif isinstance(item, Function) and item.name.lower() in ("rgb", "rgba"):
+        arguments = [
+            [part for part in argument if not isinstance(part, WhitespaceToken)]
+            for argument in item.arguments
+        ]
+        if len(arguments) not in (3, 4):
+            return None
+        channels = [color_channel(argument, 1) for argument in arguments[:3]]
+        channels.append(color_channel(arguments[3], 255) if len(arguments) == 4 else 255)
+        if None in channels:
+            return None
+        r, g, b, a = channels
+        return Color(r << 24 | g << 16 | b << 8 | a)
+    return None
+
+
+def keyword(*names: str):
+    keywords = {name: Keyword(name) for name in names}
+
+    def parse(item):
+        if isinstance(item, IdentToken):
+            return keywords.get(item.value.lower())
+        return None
+
+    return parse
+
+
+# grammars take a value's significant items and return its typed value, or
+# None if the value doesn't match
+
+
+# one component, of any of the given kinds
+class Single:
+    def __init__(self, *parsers):
+        self.parsers = parsers
+
+    def parse_component(self, item):
+        for parser in self.parsers:
+            value = parser(item)
+            if value is not None:
+                return value
+        return None
+
+    def parse(self, items):
+        if len(items) != 1:
+            return None
+        return self.parse_component(items[0])
+
+
+# minimum to maximum components of the same kinds, as a tuple
+class Repeat:
+    def __init__(self, single: Single, minimum: int, maximum: int):
+        self.single = single
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def parse(self, items):
+        if not self.minimum <= len(items) <= self.maximum:
+            return None
+        values = tuple(map(self.single.parse_component, items))
+        return None if None in values else values
+
+
+# one or more of the given components in any order, each at most once (the
+# || combinator), as a tuple in grammar order with None for those left out
+class AnyOrder:
+    def __init__(self, *singles: Single):
+        self.singles = singles
+
+    def parse(self, items):
+        if not 1 <= len(items) <= len(self.singles):
+            return None
+        values = [None] * len(self.singles)
+        for item in items:
+            for i, single in enumerate(self.singles):
+                if values[i] is None:
+                    value = single.parse_component(item)
+                    if value is not None:
+                        values[i] = value
+                        break
+            else:
+                return None
+        return tuple(values)
+
+
+LENGTH_PERCENTAGE = Single(length, percentage)
+LENGTH_PERCENTAGE_AUTO = Single(length, percentage, keyword("auto"))
+NON_NEGATIVE_LENGTH_PERCENTAGE = Single(non_negative(length), non_negative(percentage))
+BORDER_WIDTH = Single(non_negative(length), keyword("thin", "medium", "thick"))
+BORDER_STYLE = Single(
+    keyword("none", "hidden", "dotted", "dashed", "solid", "double", "groove", "ridge", "inset", "outset")
+)
+COLOR = Single(color, keyword("currentcolor"))
+BORDER = AnyOrder(BORDER_WIDTH, BORDER_STYLE, COLOR)
+
+SIDES = ["top", "right", "bottom", "left"]
+
+PROPERTY_GRAMMARS = {
+    "width": Single(non_negative(length), non_negative(percentage), keyword("auto")),
+    "height": Single(non_negative(length), non_negative(percentage), keyword("auto")),
+    "min-width": NON_NEGATIVE_LENGTH_PERCENTAGE,
+    "min-height": NON_NEGATIVE_LENGTH_PERCENTAGE,
+    "max-width": Single(non_negative(length), non_negative(percentage), keyword("none")),
+    "max-height": Single(non_negative(length), non_negative(percentage), keyword("none")),
+    "margin": Repeat(LENGTH_PERCENTAGE_AUTO, 1, 4),
+    "padding": Repeat(NON_NEGATIVE_LENGTH_PERCENTAGE, 1, 4),
+    "border": BORDER,
+    "border-width": Repeat(BORDER_WIDTH, 1, 4),
+    "border-style": Repeat(BORDER_STYLE, 1, 4),
+    "border-color": Repeat(COLOR, 1, 4),
+    "color": COLOR,
+    "background-color": COLOR,
+    "opacity": Single(number),
+    "z-index": Single(integer, keyword("auto")),
+    "display": Single(
+        keyword(
+            "inline", "block", "list-item", "inline-block", "table", "inline-table",
+            "table-row-group", "table-header-group", "table-footer-group", "table-row",
+            "table-column-group", "table-column", "table-cell", "table-caption",
+            "flex", "inline-flex", "grid", "inline-grid", "contents", "none",
+        )
+    ),
+    "position": Single(keyword("static", "relative", "absolute", "fixed", "sticky")),
+    "float": Single(keyword("left", "right", "none")),
+    "clear": Single(keyword("none", "left", "right", "both")),
+    "visibility": Single(keyword("visible", "hidden", "collapse")),
+    "overflow": Single(keyword("visible", "hidden", "scroll", "auto")),
+    "box-sizing": Single(keyword("content-box", "border-box")),
+    "text-align": Single(keyword("left", "right", "center", "justify", "start", "end")),
+    "white-space": Single(keyword("normal", "pre", "nowrap", "pre-wrap", "pre-line")),
+    "font-style": Single(keyword("normal", "italic", "oblique")),
+    "font-weight": Single(keyword("normal", "bold", "bolder", "lighter"), integer),
+    "font-size": Single(
+        non_negative(length),
+        non_negative(percentage),
+        keyword(
+            "xx-small", "x-small", "small", "medium", "large", "x-large", "xx-large",
+            "larger", "smaller",
+        ),
+    ),
+    "line-height": Single(keyword("normal"), non_negative(number), non_negative(length), non_negative(percentage)),
+}
+for side in SIDES:
+    PROPERTY_GRAMMARS[side] = LENGTH_PERCENTAGE_AUTO
+    PROPERTY_GRAMMARS[f"margin-{side}"] = LENGTH_PERCENTAGE_AUTO
+    PROPERTY_GRAMMARS[f"padding-{side}"] = NON_NEGATIVE_LENGTH_PERCENTAGE
+    PROPERTY_GRAMMARS[f"border-{side}"] = BORDER
+    PROPERTY_GRAMMARS[f"border-{side}-width"] = BORDER_WIDTH
+    PROPERTY_GRAMMARS[f"border-{side}-style"] = BORDER_STYLE
+    PROPERTY_GRAMMARS[f"border-{side}-color"] = COLOR
+
+CSS_WIDE = Single(keyword(*CSS_WIDE_KEYWORDS))
+
+# typed values by property and value_key; values repeat so much that this
+# rarely fills up, and when it does it just starts over
+VALUE_CACHE = {}
+MAX_CACHED_VALUES = 1 << 16
+
+# what VALUE_CACHE holds for a value that doesn't match its grammar
+INVALID = object()
+
+
+# the typed value of a declaration, or None for a property without a grammar
+# here or a value that doesn't match it; equal values get the same object,
+# which mustn't be changed
+def parse_value(declaration: Declaration):
+    return parse_property_value(declaration.name, declaration.value)
+
+
+def parse_property_value(name: str, items):
+    name = name.lower()
+    grammar = PROPERTY_GRAMMARS.get(name)
+    if grammar is None:
+        return None
+    key = (name, value_key(items))
+    value = VALUE_CACHE.get(key)
+    if value is None:
+        items = [item for item in items if not isinstance(item, WhitespaceToken)]
+        value = CSS_WIDE.parse(items)
+        if value is None:
+            value = grammar.parse(items)
+        if len(VALUE_CACHE) >= MAX_CACHED_VALUES:
+            VALUE_CACHE.clear()
+        VALUE_CACHE[key] = INVALID if value is None else value
+    return None if value is INVALID else value
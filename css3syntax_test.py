@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+import codecs
+import os
+import tempfile
+
+from css3syntax import cache as cache_module, instrument, parallel, parser as parser_module, tokenize_file
+from css3syntax.batch import parse_declaration_lists, tokenize_batch
+from css3syntax.cache import DiskCache, ParseCache
+from css3syntax.incremental import reparse
+from css3syntax.media import Environment, MediaIndex, media_query_list_matches
+from css3syntax.values import Color, Keyword, Length, Number, Percentage, parse_value
+from css3syntax.names import NAMES
+from css3syntax.parser import AtRule, Declaration, Function, ParseHandler, Parser, SimpleBlock, StyleRule
+from css3syntax.tokenizer import IdentToken, Token, Tokenizer, WhitespaceToken
+
+
+def file_tokens(data, **kwargs):
+    with tempfile.NamedTemporaryFile(suffix=".css", delete=False) as f:
+        f.write(data)
+    try:
+        return list(tokenize_file(f.name, **kwargs))
+    finally:
+        os.remove(f.name)
+
+
+expected = list(Tokenizer().tokenize("a {\n  color: red;\n  content: \"é中\"\n}\n"))
+source = "a {\r\n  color: red;\f  content: \"é中\"\r}\r\n"
+for chunk_size in (1, 2, 3, 64, 65536):
+    assert file_tokens(source.encode("utf-8"), chunk_size=chunk_size) == expected
+    assert file_tokens(codecs.BOM_UTF8 + source.encode("utf-8"), chunk_size=chunk_size) == expected
+    assert file_tokens(codecs.BOM_UTF16_LE + source.encode("utf-16-le"), chunk_size=chunk_size) == expected
+    assert file_tokens(source.encode("utf-8"), chunk_size=chunk_size, fast=False) == expected
+
+charset = '@charset "iso-8859-1"; a { content: "é" }'
+assert file_tokens(charset.encode("latin-1")) == list(Tokenizer().tokenize(charset))
+assert file_tokens(b"") == list(Tokenizer().tokenize(""))
+assert file_tokens(codecs.BOM_UTF8) == list(Tokenizer().tokenize(""))
+
+
+def parse(s):
+    return Parser(Tokenizer().tokenize(s)).parse()
+
+
+def dump(node):
+    if isinstance(node, Token):
+        return repr(node)
+    elif isinstance(node, Function):
+        return ("function", node.name, [[dump(item) for item in argument] for argument in node.arguments])
+    elif isinstance(node, SimpleBlock):
+        return ("block", repr(node.associated_token), [dump(item) for item in node.value])
+    elif isinstance(node, Declaration):
+        return ("declaration", node.name, node.important, [dump(item) for item in node.value])
+    elif isinstance(node, AtRule):
+        return ("at-rule", node.name, [dump(item) for item in node.prelude], [dump(item) for item in node.value])
+    elif isinstance(node, StyleRule):
+        return ("style-rule", [dump(item) for item in node.selector], [dump(item) for item in node.value])
+    else:
+        return ("stylesheet", [dump(item) for item in node.value])
+
+
+stylesheet = parse("a { color: red !important; b: c } @media print { d { e: f } } @font-face { g: h } @unknown { i }")
+[a, media, font_face, unknown] = stylesheet.value
+assert [(d.name, d.important) for d in a.value] == [("color", True), ("b", False)]
+assert a.value[0].value == (WhitespaceToken(), IdentToken("red"), WhitespaceToken())
+assert isinstance(a.selector, tuple) and not hasattr(a, "__dict__")
+assert isinstance(media.value[0], StyleRule) and media.value[0].value[0].name == "e"
+assert font_face.value[0].name == "g"
+assert isinstance(unknown.value[0], SimpleBlock)
+assert dump(parse("a { b: c")) == dump(parse("a { b: c}"))
+assert dump(parse("a { (x}) ; b: c }")) == dump(parse("a { ; b: c }"))
+
+assert parallel.find_split_points("a{}b{}c{}d{}", 4) == [3, 6, 9]
+assert parallel.find_split_points("a{}'}'{}b{}", 3) == [3, 8]
+assert parallel.find_split_points("a{/*}*/}b{x:url(})}c{}", 3) == [8, 19]
+assert parallel.find_split_points("a{x:url(})}b{}", 2) == [11]
+assert parallel.find_split_points("a{x:\\{url(})}b{}", 2) == []
+assert parallel.find_split_points("a{]}b{}c{}", 2) == []
+
+parallel.MINIMUM_CHUNK_SIZE = 16
+source = "@import 'x';" + "".join(
+    f".c{i}\\:hover, a[href$='}}'] {{ /* }} */ m: url({{{i}}}) f({i}, [x]) !important }} @media (min-width: {i}px) {{ p {{ q: r }} }} "
+    for i in range(200)
+)
+assert dump(parallel.parse_parallel(source, max_workers=4)) == dump(parse(source))
+assert dump(parallel.parse_parallel(source, max_workers=1)) == dump(parse(source))
+
+# a "}" in a block ends it even in an at-rule's prelude or a nested rule's
+# selector, so the parser's blocks nest as the scan's braces do
+assert parallel.find_split_points('a{}b{x:u\\72l("y")}c{}', 2) == [18]
+assert len(parse("a { @apply --x } b { c: d }").value) == 2
+assert len(parse("a { b: c } d { @media print { e: f } } g { h: i }").value) == 3
+for css in ["a { @apply --x } b { c: d } ", "a { b: c } d { @media print { e: f } } g { h: i } ", 'a{}b{x:u\\72l("y")}c{}']:
+    assert dump(parallel.parse_parallel(css * 8, max_workers=4)) == dump(parse(css * 8))
+
+# token positions are in the whole stylesheet, however it was split
+def positions(stylesheet) -> list:
+    tokens = [token for rule in stylesheet.value for token in rule.selector]
+    tokens += [token for rule in stylesheet.value for declaration in rule.value for token in declaration.value]
+    return [token.position for token in tokens if not isinstance(token, WhitespaceToken)]
+
+css = "a { b: 1px 'c' #d } e.f { g: 50% } " * 40
+assert positions(parallel.parse_parallel(css, max_workers=4)) == positions(parse(css))
+assert -1 not in positions(parse(css)) and {token.position for token in tokenize_batch([css])[0]} == {-1}
+
+inputs = ["color: red", "width: 10px; color: red", "color: red", "a > b"]
+batch = tokenize_batch(iter(inputs))
+assert batch == [list(Tokenizer().tokenize(s)) for s in inputs]
+assert batch[0] is batch[2] and batch[0][0] is batch[1][6] and batch[0][3] is batch[1][9]
+assert batch[1][3] == Tokenizer().tokenize("10px").__next__()
+numbers = ["w: 50%", "w: 50.0%", "w: 0", "w: -0.0"]
+assert [repr(tokens[3]) for tokens in tokenize_batch(numbers)] == [repr(next(Tokenizer().tokenize(s[3:]))) for s in numbers]
+[first, second, third, fourth] = parse_declaration_lists(inputs)
+assert [(d.name, [str(item) for item in d.value]) for d in second] == [("width", ["WS", "DIM(10, px)"]), ("color", ["WS", "IDENT(red)"])]
+assert first is third and [d.name for d in first] == ["color"]
+assert fourth == ()
+assert [d.name for d in parse_declaration_lists(["a: b; } c: d; e: f } g"])[0]] == ["a", "e"]
+
+cache = ParseCache(max_entries=2)
+tokens = cache.tokenize("a { b: c }")
+assert isinstance(tokens, tuple) and list(tokens) == list(Tokenizer().tokenize("a { b: c }"))
+assert cache.tokenize("a { b: c }") is tokens
+first = cache.parse("a { b: c }")
+assert dump(first) == dump(parse("a { b: c }")) and cache.parse("a { b: c }") is first
+assert cache.stats() == {"entries": 2, "bytes": cache.size, "hits": 2, "misses": 2, "evictions": 0}
+cache.parse("d { e: f }")
+assert cache.stats()["evictions"] == 1 and cache.tokenize("a { b: c }") is not tokens
+small = ParseCache(max_bytes=cache.size)
+small.parse("x { y: " + "z" * 100000 + " }")
+assert len(small) == 0 and small.stats()["misses"] == 1
+
+# reparsing keeps the rules whose text is unchanged, even where they moved
+css = "@import 'x'; a { b: c } @media print { d { e: f } } g { h: i } g { h: i } j { k: l"
+first = reparse(None, css)
+assert dump(first) == dump(parse(css)) and len(first.chunks) == 5
+edited = css.replace("a { b: c }", "a { b: changed } z { }").replace("@media", " @media")
+second = reparse(first, edited)
+assert dump(second) == dump(parse(edited))
+[_, a, z, media, g1, g2, j] = second.value
+assert [g1, g2, j] == list(first.value[3:]) and g1 is not g2
+assert media is not first.value[2] and a is not first.value[1]
+assert reparse(second, "").value == () and dump(reparse(first, "}{")) == dump(parse("}{"))
+for css in ["a { @apply --x } b { c: d }", "a { b: c } d { @media print { e: f } } g { h: i }", 'a{}b{x:u\\72l("y")}c{}']:
+    assert dump(reparse(None, css)) == dump(parse(css))
+    assert dump(reparse(reparse(None, css), "x {} " + css)) == dump(parse("x {} " + css))
+
+# instrumentation is only there inside instrumented(), and comes out as a dict
+css = "a { b: c } @media print { d { e: f(1px) } }"
+with instrument.instrumented(memory=True) as stats:
+    with instrument.phase("selectors"):
+        assert dump(parse(css)) == dump(Parser(Tokenizer().tokenize(css), instrumentation=None).parse())
+report = stats.as_dict()
+expected = {}
+for token in Tokenizer().tokenize(css):
+    expected[type(token).__name__] = expected.get(type(token).__name__, 0) + 2
+assert report["tokens"] == expected and report["tokenize_seconds"] > 0
+assert set(report["modes"]) == {"top_level_mode", "at_rule_mode", "rule_mode", "selector_mode", "declaration_mode", "after_declaration_name_mode", "declaration_value_mode"}
+assert report["modes"]["selector_mode"]["calls"] == 12
+assert report["phases"]["parse"]["count"] == 2 and report["phases"]["selectors"]["count"] == 1
+assert 0 < report["phases"]["parse"]["peak_bytes"] <= report["phases"]["selectors"]["peak_bytes"]
+assert report["phases"]["parse"]["wall_seconds"] <= report["phases"]["selectors"]["wall_seconds"]
+assert instrument.ACTIVE is None and Parser([]).instrumentation is None
+with instrument.phase("nothing"):
+    pass
+
+# equivalent media queries share a group, and each is only evaluated once per
+# environment
+css = """a {} @media screen and (min-width: 600px) { b {} @media (max-width: 50em) { c {} } }
+@media print, (min-width: 37.5em) and screen { d {} } @media not print { e {} } @media (bogus: 1) { f {} }
+@media ONLY screen and (MIN-WIDTH: 37.5EM) { g {} } @media { h {} } @media only screen and (min-resolution: 192dpi) { i {} }"""
+index = MediaIndex(parse(css))
+assert len(index.groups) == 8
+
+
+def selectors(rules):
+    return [str(rule.selector[0]) for rule in rules]
+
+
+assert selectors(index.rules(Environment(400))) == ["IDENT(a)", "IDENT(e)", "IDENT(h)"]
+assert selectors(index.rules(Environment(700))) == ["IDENT(a)", "IDENT(b)", "IDENT(c)", "IDENT(e)", "IDENT(g)", "IDENT(h)"]
+assert selectors(index.rules(Environment(900, resolution=2))) == ["IDENT(a)", "IDENT(b)", "IDENT(e)", "IDENT(g)", "IDENT(h)", "IDENT(i)"]
+assert selectors(index.rules(Environment(700, "print"))) == ["IDENT(a)", "IDENT(d)", "IDENT(h)"]
+misses = media_query_list_matches.cache_info().misses
+assert index.rules(Environment(700)) is index.rules(Environment(700))
+assert selectors(MediaIndex(parse(css)).rules(Environment(700))) == selectors(index.rules(Environment(700)))
+assert media_query_list_matches.cache_info().misses == misses
+
+# declaration values come out typed, per property, and equal values are
+# parsed once
+css = """a { margin: 0 auto; padding: 1px 2% 3em; border: 1px solid; border-top: red dashed; color: #fff8;
+background-color: rgba(255, 0, 10%, .5); width: -1px; z-index: 3; opacity: .5; font-weight: 700;
+color: INHERIT; foo: bar; color: #12345; margin:0   auto }"""
+[a] = parse(css).value
+assert [parse_value(declaration) for declaration in a.value] == [
+    (Length(0, "px"), Keyword("auto")),
+    (Length(1, "px"), Percentage(2), Length(3, "em")),
+    (Length(1, "px"), Keyword("solid"), None),
+    (None, Keyword("dashed"), Color(0xFF0000FF)),
+    Color(0xFFFFFF88),
+    Color(0xFF001A80),
+    None,
+    Number(3),
+    Number(0.5),
+    Number(700),
+    Keyword("inherit"),
+    None,
+    None,
+    (Length(0, "px"), Keyword("auto")),
+]
+assert parse_value(a.value[0]) is parse_value(a.value[-1])
+[a] = parse("a { color: #-12345; color: #f_ff_f; color: #c0ffee; opacity: 1; opacity: 1.0 }").value
+assert [parse_value(declaration) for declaration in a.value] == [None, None, Color(0xC0FFEEFF), Number(1), Number(1.0)]
+assert type(parse_value(a.value[-1]).value) is float
+
+# with hash_cons, identical declarations, blocks and rules are shared between
+# stylesheets for as long as any of them is alive
+css = "a { margin: 0; padding: 0 } b { margin: 0; padding: 0 } @media print { a { margin: 0; padding: 0 } } c { width: 1% } c { width: 1.0% }"
+first = Parser(Tokenizer().tokenize(css), hash_cons=True).parse()
+second = Parser(Tokenizer(fast=True).tokenize(css), hash_cons=True).parse()
+assert dump(first) == dump(second) == dump(parse(css))
+assert all(x is y for x, y in zip(first.value, second.value))
+[a, b, media, c1, c2] = first.value
+assert a is media.value[0] and a is not b and a.value is b.value
+assert c1 is not c2 and c1.value[0] is not c2.value[0]
+del first, second, a, b, media, c1, c2
+assert len(parser_module.INTERNED_NODES) == 0 and len(parser_module.INTERNED_BLOCKS) == 0
+
+# a tree saved by one DiskCache is loaded by the next, unless the parser
+# version or the file itself has changed since
+css = "<!-- @import url(x.css); a#b, [c='d'] > e:f(2n+1) { g: -1.5em 50% +3 \\68 \"i\" !important; j: k(l, (m)) } @media (n) { o { p: q } } @unknown r { s } -->"
+with tempfile.TemporaryDirectory() as directory:
+    first = DiskCache(directory).parse(css)
+    [path] = [os.path.join(directory, name) for name in os.listdir(directory)]
+    disk = DiskCache(directory)
+    assert dump(disk.parse(css)) == dump(first) == dump(parse(css)) and disk.stats() == {"hits": 1, "misses": 0}
+    unicode_ranges = DiskCache(directory, unicode_ranges_allowed=True)
+    assert dump(unicode_ranges.parse("a { b: u+0-7f }")) == dump(Parser(Tokenizer(True).tokenize("a { b: u+0-7f }")).parse())
+    assert dump(unicode_ranges.parse("a { b: u+0-7f }")) != dump(disk.parse("a { b: u+0-7f }"))
+    cache_module.PARSER_VERSION += 1
+    try:
+        assert dump(disk.parse(css)) == dump(first) and disk.stats()["misses"] == 2
+    finally:
+        cache_module.PARSER_VERSION -= 1
+    assert disk.parse(css) and disk.stats()["misses"] == 3
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+    assert dump(disk.parse(css)) == dump(first) and disk.stats()["misses"] == 4
+    assert dump(DiskCache(directory).parse(css)) == dump(first)
+
+tokens = list(Tokenizer(fast=True, intern_names=True).tokenize("a { background-color: red } @media print { b { font-size: 1px } }"))
+[a, media] = Parser(tokens).parse().value
+assert a.value[0].name is NAMES["background-color"] and media.name is NAMES["media"]
+assert media.value[0].value[0].name is NAMES["font-size"]
+
+# the parser pulls tokens one at a time, and running out of them is the end
+tokens = Tokenizer().tokenize("a { b: c } d { e: f }")
+stylesheet = Parser(tokens).parse()
+assert next(tokens, None) is None and len(stylesheet.value) == 2
+assert dump(Parser(list(Tokenizer().tokenize("a { b: c }"))[:-1]).parse()) == dump(parse("a { b: c }"))
+
+class Recorder(ParseHandler):
+    def __init__(self):
+        self.events = []
+
+    def start_at_rule(self, rule):
+        self.events.append(("start_at_rule", rule.name, len(rule.prelude)))
+
+    def start_style_rule(self, rule):
+        self.events.append(("start_style_rule", [str(item) for item in rule.selector]))
+
+    def declaration(self, declaration):
+        self.events.append(("declaration", declaration.name, declaration.important))
+
+    def end_rule(self, rule):
+        self.events.append(("end_rule", type(rule).__name__, rule.value))
+
+
+recorder = Recorder()
+css = "@import 'x'; a { b: c !important } @media print { d { e: f } } @font-face { g: h } g { h: i"
+stylesheet = Parser(Tokenizer().tokenize(css), recorder).parse()
+assert stylesheet.value == ()
+assert recorder.events == [
+    ("start_at_rule", "import", 2),
+    ("end_rule", "AtRule", ()),
+    ("start_style_rule", ["IDENT(a)", "WS"]),
+    ("declaration", "b", True),
+    ("end_rule", "StyleRule", ()),
+    ("start_at_rule", "media", 3),
+    ("start_style_rule", ["IDENT(d)", "WS"]),
+    ("declaration", "e", False),
+    ("end_rule", "StyleRule", ()),
+    ("end_rule", "AtRule", ()),
+    ("start_at_rule", "font-face", 1),
+    ("declaration", "g", False),
+    ("end_rule", "AtRule", ()),
+    ("start_style_rule", ["IDENT(g)", "WS"]),
+    ("declaration", "h", False),
+    ("end_rule", "StyleRule", ()),
+]
+
+# a lazy parse only collects each style rule's block, and parses it when its
+# value is first read
+css = "a { b: (}) c; @page x { d: e } f: g [ } ] !important } @media print { h { i: j } } k { l: m"
+lazy = Parser(Tokenizer().tokenize(css), lazy=True).parse()
+[a, media, k] = lazy.value
+assert a.block_tokens is not None and media.value[0].block_tokens is not None
+assert dump(lazy) == dump(parse(css))
+for css in ["'}'@page{@media xa}@media x", "a { @media print { b } c: d } e { @x } f {}"]:
+    assert dump(Parser(Tokenizer().tokenize(css), lazy=True).parse()) == dump(parse(css))
+assert a.block_tokens is None and a.value is a.value
+a.value = []
+assert a.value == []
+
+print("all tests passed.")